@@ -2,7 +2,20 @@ import sys
 import os
 import random
 import math
+import io
+import json
+import csv
+import hashlib
+import time
+import threading
+import functools
+import itertools
+import collections
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
+import multiprocessing
+from contextlib import contextmanager, nullcontext
 from pathlib import Path
 from enum import Enum
 from reportlab.pdfgen import canvas
@@ -13,33 +26,205 @@ from reportlab.lib.enums import TA_JUSTIFY
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch
+from reportlab.lib.rl_accel import fp_str
+
+try:
+    # optional: lets editBooklet() reuse the pages of a booklet
+    # instead of rendering the whole booklet again.
+    import pypdf
+except ImportError:
+    pypdf = None
 
 
 #c = canvas.Canvas("hello.pdf")
 #c.drawString(100, 750, "Welcome to PDF generation from Python!")
 #c.save()
 
+# set to True when run as a script
+debug_flag=False
+
+# where our messages go. None means stdout, but when the PDF itself
+# is written to stdout ('-output -') they have to go to stderr.
+log_stream=None
+
+# shape images live next to src/, so that we do not
+# depend on the directory we are being run from.
+IMAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'images')
+
+def imagePath(name):
+    return os.path.join(IMAGES_DIR, name)
+
+# Every booklet has a seed, and everything random about it is drawn from
+# independent streams derived from that seed (see streamRng):
+#   question content: (seed, QUESTION_STREAM, difficulty, index, attempt)
+#   question layout:  (seed, LAYOUT_STREAM, puzzle number)
+# so a booklet, or any one puzzle in it, can be regenerated from its seed.
+QUESTION_STREAM=0
+LAYOUT_STREAM=1
+
+def newSeed():
+    return random.SystemRandom().randrange(2**32)
+
+def streamRng(*key):
+    # an independent random generator for every key (a tuple of
+    # non-negative ints), identical across runs and processes.
+    state = np.random.SeedSequence(list(key)).generate_state(2, dtype=np.uint64)
+    return random.Random((int(state[0]) << 64) | int(state[1]))
+
+class BBError(Exception):
+    # raised instead of exiting the process, so that
+    # library users can decide what to do about it.
+    pass
+
 def info(string):
-    print ('[INFO]:' + str(string))
+    print ('[INFO]:' + str(string), file=log_stream)
 
 def warn(string):
-    print ('[WARN]:' + str(string))
+    print ('[WARN]:' + str(string), file=log_stream)
 
 def error(string):
-    print ('[ERROR]:' + str(string))
+    print ('[ERROR]:' + str(string), file=log_stream)
 
 def debug(string):
     if debug_flag:
-        print('[DEBUG]:'+str(string))
+        print('[DEBUG]:'+str(string), file=log_stream)
+
+class Tracer:
+    # Records how long the phases of a run take (question generation,
+    # hint search, page layout, image loading, saving the PDF) so that we
+    # can see where a slow booklet spent its time.
+    # Spans are exported in the Chrome trace event format, which can be
+    # opened in chrome://tracing or https://ui.perfetto.dev
+    # A disabled tracer records nothing and hands out a shared no-op span,
+    # so leaving the calls in the hot paths costs next to nothing.
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.events = list()
+        self.lock = threading.Lock()
+        self.origin = time.perf_counter()
+        self.pid = os.getpid()
+        self.null_span = nullcontext()
+
+    def now(self):
+        if not self.enabled:
+            return 0
+        return time.perf_counter()
+
+    def span(self, name, cat='bb', **args):
+        if not self.enabled:
+            return self.null_span
+        return self.timedSpan(name, cat, args)
+
+    @contextmanager
+    def timedSpan(self, name, cat, args):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.addEvent(name, cat, start, time.perf_counter(), args)
+
+    def record(self, name, cat, start, **args):
+        # for spans that can not be wrapped in a 'with' block,
+        # eg: a page is started in one method and finished in another.
+        if self.enabled:
+            self.addEvent(name, cat, start, time.perf_counter(), args)
+
+    def addEvent(self, name, cat, start, end, args):
+        event = {
+            'name': name,
+            'cat': cat,
+            'ph': 'X',
+            'ts': (start - self.origin) * 1e6,
+            'dur': (end - start) * 1e6,
+            'pid': self.pid,
+            'tid': threading.get_ident(),
+            'args': args,
+        }
+        with self.lock:
+            self.events.append(event)
+
+    def writeChromeTrace(self, file_name):
+        with open(file_name, 'w') as f:
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, f)
+
+    def summary(self):
+        # total, count, mean and max duration per span name,
+        # with the most expensive phases first.
+        totals = dict()
+        for event in self.events:
+            t = totals.setdefault(event['name'], [0, 0.0, 0.0])
+            t[0] += 1
+            t[1] += event['dur']
+            t[2] = max(t[2], event['dur'])
+        lines = list()
+        lines.append('%-28s %8s %12s %12s %12s' % ('span', 'count', 'total(ms)', 'mean(ms)', 'max(ms)'))
+        for name, t in sorted(totals.items(), key=lambda item: -item[1][1]):
+            lines.append('%-28s %8d %12.3f %12.3f %12.3f' % (name, t[0], t[1]/1000, t[1]/1000/t[0], t[2]/1000))
+        return lines
+
+    def printSummary(self):
+        for line in self.summary():
+            info(line)
 
 class Difficulty(Enum):
     EASY=1
     MEDIUM=2
     HARD=3
+    EXPERT=4
+
+class Implication(Enum):
+    # how a choice relates to the hints of its question,
+    # over every assignment of values the bounds allow.
+    IMPLIED=1
+    CONTRADICTED=2
+    UNDETERMINED=3
+
+@functools.lru_cache(maxsize=None)
+def assignmentSpace(num_vars, max_value):
+    # every assignment of the values 1..max_value to num_vars variables,
+    # one assignment per row. At most 4^6 or 3^7 rows for our levels,
+    # and 3^12 for EXPERT. Stored as float32 (exact for our small
+    # integers) so that relationMask can use a fast matrix product.
+    values = np.arange(1, max_value+1, dtype=np.float32)
+    grid = np.meshgrid(*([values]*num_vars), indexing='ij')
+    points = np.stack(grid, axis=-1).reshape(-1, num_vars)
+    # shared between questions (and threads), so nobody may modify it
+    points.setflags(write=False)
+    return points
+
+def relationMask(hints, points):
+    # for each hint (row) and each assignment (column),
+    # whether 'lhs op rhs' holds, computed in one pass.
+    diff = np.array([[l - r for l, r in zip(h.lhs, h.rhs)] for h in hints], dtype=points.dtype)
+    values = diff @ points.T
+    ops = np.array([h.op for h in hints])[:, np.newaxis]
+    return np.where(ops == '=', values == 0, np.where(ops == '<', values < 0, values > 0))
+
+@functools.lru_cache(maxsize=None)
+def coefficientGrid(num_vars, max_coefficient):
+    # every choice of coefficients 0..max_coefficient
+    # for num_vars variables, one choice per row.
+    grid = np.indices((max_coefficient+1,)*num_vars).reshape(num_vars, -1).T
+    grid.setflags(write=False)
+    return grid
+
+# We only have 6 shape images, and show each of them plain and with a
+# dot (see MarkedShape). Past 3^12 assignments (EXPERT), solving the
+# hints (see assignmentSpace) gets too big, and past 2^18 rows a hint
+# search (see makeHintsMedium and makeHintsExpert) gets too slow.
+MAX_VARIABLES=12
+MAX_ASSIGNMENTS=3**12
+MAX_SEARCH_ROWS=2**18
 
 class Bounds:
-    def __init__(self, difficulty):
+    # what can be changed in a level's bounds (see Bounds(difficulty, ...))
+    names = ('min_variables', 'max_variables', 'max_variable_value', 'use_inequality', 'max_coefficient', 'max_constant', 'num_choices')
+
+    def __init__(self, difficulty, **overrides):
+        if not isinstance(difficulty, Difficulty):
+            raise BBError('Bounds need a difficulty level, not: ' + str(difficulty) + ' (use: ' + ', '.join(d.name for d in Difficulty) + ')')
         self.difficulty = difficulty
+        self.min_variables = 3
         if difficulty == Difficulty.EASY:
             self.max_variables = 6
             self.max_variable_value=4
@@ -61,8 +246,79 @@ class Bounds:
             self.max_coefficient=3
             self.max_constant=1000
             self.num_choices=6
+        if difficulty == Difficulty.EXPERT:
+            # bigger systems for older students.
+            # hints are found with makeHintsExpert.
+            self.min_variables = 10
+            self.max_variables = 12
+            self.max_variable_value=3
+            self.use_inequality=False
+            self.max_coefficient=5
+            self.max_constant=10000
+            self.num_choices=6
+        # user-defined bounds start from a level's preset, which also
+        # decides how their hints are made (see Question.makeHints).
+        # eg: Bounds(Difficulty.MEDIUM, max_variables=5, max_variable_value=6, max_coefficient=4)
+        for name, value in overrides.items():
+            if name not in Bounds.names:
+                raise BBError('Unknown bound: ' + name + ' (use: ' + ', '.join(Bounds.names) + ')')
+            setattr(self, name, value)
+        self.overrides = dict(overrides)
+
+    def isCustom(self):
+        return len(self.overrides) > 0
+
+    def infeasibleReason(self):
+        # why no question can be made (in reasonable time) within
+        # these bounds, or None if nothing is obviously wrong.
+        # estimateCost() finds out about the rest by trying.
+        for name in Bounds.names:
+            value = getattr(self, name)
+            if name == 'use_inequality':
+                if not isinstance(value, bool):
+                    return 'use_inequality must be true or false'
+            elif isinstance(value, bool) or not isinstance(value, int):
+                return name + ' must be an integer'
+        if self.min_variables < 3:
+            # with 2 variables, every correct choice is the hint itself
+            return 'min_variables must be at least 3'
+        if self.max_variables < self.min_variables:
+            return 'max_variables must be at least min_variables (' + str(self.min_variables) + ')'
+        if self.max_variables > MAX_VARIABLES:
+            return 'max_variables can not be more than ' + str(MAX_VARIABLES) + ': there are no shapes for more'
+        if self.max_variable_value < 2:
+            return 'max_variable_value must be at least 2'
+        if self.max_coefficient < 1:
+            return 'max_coefficient must be at least 1'
+        # shapes have to fit on the scales (and in a SharedQuestionStore)
+        if self.max_coefficient > 10:
+            return 'max_coefficient can not be more than 10'
+        if self.max_variable_value > 10:
+            return 'max_variable_value can not be more than 10'
+        if self.max_constant < 1:
+            return 'max_constant must be at least 1'
+        if self.num_choices < 3 or self.num_choices > 8:
+            return 'num_choices must be between 3 and 8'
+        if self.difficulty == Difficulty.EXPERT and self.min_variables < 5:
+            # makeHintsExpert splits what its (up to 3 variable) LHS
+            # leaves over into two halves, neither of which may be empty
+            return 'min_variables must be at least 5 at level EXPERT'
+        if self.max_variable_value ** self.max_variables > MAX_ASSIGNMENTS:
+            return 'max_variable_value^max_variables can not be more than ' + str(MAX_ASSIGNMENTS)
+        if self.difficulty == Difficulty.MEDIUM:
+            search_vars = self.max_variables
+        elif self.difficulty == Difficulty.EXPERT:
+            search_vars = math.ceil((self.max_variables - 2)/2)
+        else:
+            search_vars = 0
+        if (self.max_coefficient+1) ** search_vars > MAX_SEARCH_ROWS:
+            return 'max_coefficient is too big for ' + str(self.max_variables) + ' variables at level ' + self.difficulty.name
+        return None
+
     def allowInequality(self):
         return self.use_inequality
+    def getMinVariables(self):
+        return self.min_variables
     def getMaxVariables(self):
         return self.max_variables
     def getMaxVariableValue(self):
@@ -70,7 +326,7 @@ class Bounds:
     def getMaxCoefficient(self):
         return self.max_coefficient
     def getMaxConstant(self):
-        return self.max_numeric_constant
+        return self.max_constant
 
 class Hint:
     def __init__(self, vars, lhs, op, rhs):
@@ -84,6 +340,7 @@ class Hint:
             self.rhs.append(rhs[i])
         self.op=op
         self.fail=False
+        self.implication=None
     def getLHSCoeffTotal(self):
         t=0
         for i in self.lhs:
@@ -225,11 +482,31 @@ class Hint:
         return hint_str
 
 class Question:
-    def __init__(self, bounds):
+    def __init__(self, bounds, tracer=None, rng=None, record=None):
         self.bounds= bounds
+        if tracer is None:
+            tracer = Tracer(enabled=False)
+        self.tracer = tracer
+        # each question draws from the random generator it is given
+        # (never the global one), so generators in different threads
+        # do not interfere with each other.
+        if rng is None:
+            rng = random.Random()
+        self.rng = rng
         self.hints=list()
         self.num_choices = bounds.num_choices
         self.choices=list()
+        self.max_correct_choice_tries = 32
+        self.max_hint_tries = 64
+        self.max_distractor_tries = 64
+        self.complete = True
+        # how many times we made hints (see estimateCost)
+        self.hint_tries = 0
+        if record is not None:
+            # a question generated earlier, eg: by another process
+            # (see SharedQuestionStore.claim)
+            self.loadRecord(record)
+            return
         # first build up a system of linear equations 
         # using the allowed variables and coefficient limits
         # and verify that the system is consistent
@@ -241,7 +518,7 @@ class Question:
         
         debug('Variable values of the question')
         for j in range (0, self.num_vars):
-            self.vars.append(random.randint(1, bounds.getMaxVariableValue()))
+            self.vars.append(self.rng.randint(1, bounds.getMaxVariableValue()))
             debug('v'+str(j) + ': ' + str(self.vars[j]))
 
         # we discovered one bug wherein some of the answer choices
@@ -259,6 +536,12 @@ class Question:
         # but for now, assume hints are 1 less than variables
         num_hints = self.num_vars - 1
 
+        # Every variable must show up in some hint, and we used to find
+        # out only once the whole question (choices included) was built.
+        # Now each hint is steered towards a variable that is not covered
+        # yet, and is only accepted if it covers a new variable. The first
+        # hint covers at least two variables and every later one at least
+        # one more, so our num_vars-1 hints always cover all of them.
         i=0
         while (i<num_hints):
             # make a hint
@@ -268,16 +551,24 @@ class Question:
             # depict this with a balance.
             # Each <LE> can have upto num_vars with coefficients over the bounds
 
-            t_hints = self.makeHints()
+            self.hint_tries += 1
+            if self.hint_tries > self.max_hint_tries:
+                # some variable values admit no further unique hint;
+                # give up rather than search forever (see validate()).
+                debug('Could not find enough hints')
+                self.complete = False
+                return
+
+            t_hints = self.makeHints(self.uncoveredVar())
 
             for j in range(len(t_hints)):
                 # pick a random hint from the generated set
                 if len(t_hints) > 1:
-                    idx = random.randint(0, len(t_hints)-1)
+                    idx = self.rng.randint(0, len(t_hints)-1)
                 else:
                     idx = 0
                 chosen_hint = t_hints[idx]
-                if chosen_hint.validate() and self.isUnique(self.hints, chosen_hint):
+                if chosen_hint.validate() and self.isUnique(self.hints, chosen_hint) and self.coversNewVar(chosen_hint):
                     if debug_flag:
                         debug(chosen_hint.print())
 
@@ -292,41 +583,193 @@ class Question:
         # 2. no two choices must be the same!
         # 3. at least one choice should be correct!
         debug('Printing Choices..')
-        correct_star=''
-        nc=0
         if self.num_choices == 4:
             need_num_correct = 1
         else:
             need_num_correct = 2
+
+        # the incorrect choices come first, in bulk.
+        num_distractors = self.num_choices - need_num_correct
+        with self.tracer.span('makeDistractors'):
+            distractors = self.makeDistractors(num_distractors)
+        for choice in distractors:
+            self.choices.append(choice)
+            if debug_flag:
+                debug(choice.print())
+
+        # in the rare case the distractor pool was too small,
+        # fall back to drawing random choices one at a time.
+        num_tried=0
+        while len(self.choices) < num_distractors:
+            num_tried += 1
+            if num_tried > self.max_distractor_tries:
+                # eg: tiny bounds, where every pair of shapes balances
+                debug('Could not find enough incorrect choices')
+                self.complete = False
+                return
+            choice = self.makeChoice()
+            if choice.validateChoice() and self.isUnique(self.choices, choice) and not self.isIdentical(self.hints, choice):
+                if not choice.validate():
+                    self.choices.append(choice)
+                    if debug_flag:
+                        debug(choice.print())
+
+        # Holding for our own variable values is not enough to make a
+        # choice correct: the student only sees the hints, so a correct
+        # choice must hold for every assignment that satisfies them.
+        # If we can not find enough such choices, the question is
+        # marked invalid and gets discarded (see validate()).
+        self.solutions = self.solveHints()
+        for choice, implication in zip(self.choices, self.classifyChoices(self.choices)):
+            choice.implication = implication
+
         found_num_correct=0
-        while (nc < self.num_choices): 
-            add_choice=False
-            if (nc==self.num_choices-need_num_correct) and (found_num_correct < need_num_correct):
-                choices = self.makeHints()
-                if len(choices):
-                    choice = choices[0]
-            else:
-                choice = self.makeChoice()
+        num_tried=0
+        while found_num_correct < need_num_correct:
+            num_tried += 1
+            if num_tried > self.max_correct_choice_tries:
+                debug('Could not find choices implied by the hints')
+                self.complete = False
+                break
+            choices = self.makeHints()
+            if len(choices) == 0:
+                continue
+            choice = choices[0]
             if choice.validateChoice() and self.isUnique(self.choices, choice) and not self.isIdentical(self.hints, choice):
                 if choice.validate():
-                    correct_star='*'
-                    found_this_correct=True
+                    choice.implication = self.classifyChoices([choice])[0]
+                if choice.implication == Implication.IMPLIED:
                     choice.correct_choice = True
-                else:
-                    correct_star=''
-                    found_this_correct=False
-                if nc >= self.num_choices-need_num_correct:
-                    if found_this_correct:
-                        self.choices.append(choice)
-                        if debug_flag:
-                            debug(correct_star+choice.print())
-                        found_num_correct += 1
-                        nc+=1
-                else:
                     self.choices.append(choice)
                     if debug_flag:
-                        debug(correct_star+choice.print())
-                    nc+=1
+                        debug('*'+choice.print())
+                    found_num_correct += 1
+
+    def loadRecord(self, record):
+        # record: a dict with 'vars', and 'hints' and 'choices' as
+        # (lhs, op, rhs, correct) tuples.
+        self.vars = list(record['vars'])
+        self.num_vars = len(self.vars)
+        self.used_vars = [False]*self.num_vars
+        for (lhs, op, rhs, correct) in record['hints']:
+            self.addHint(Hint(self.vars, lhs, op, rhs))
+        for (lhs, op, rhs, correct) in record['choices']:
+            choice = Hint(self.vars, lhs, op, rhs)
+            choice.correct_choice = correct
+            if correct:
+                choice.implication = Implication.IMPLIED
+            self.addChoice(choice)
+        self.solutions = None
+
+    def solveHints(self):
+        # mask over assignmentSpace() of the assignments that satisfy
+        # every hint. Our own variable values are always among them.
+        points = assignmentSpace(self.num_vars, self.bounds.getMaxVariableValue())
+        return relationMask(self.hints, points).all(axis=0)
+
+    def classifyChoices(self, choices):
+        # implied: holds wherever the hints hold
+        # contradicted: holds nowhere the hints hold
+        # undetermined: the hints do not decide it
+        points = assignmentSpace(self.num_vars, self.bounds.getMaxVariableValue())[self.solutions]
+        holds = relationMask(choices, points)
+        result = list()
+        for row in holds:
+            if row.all():
+                result.append(Implication.IMPLIED)
+            elif not row.any():
+                result.append(Implication.CONTRADICTED)
+            else:
+                result.append(Implication.UNDETERMINED)
+        return result
+
+    def makeDistractors(self, count):
+        # Incorrect choices used to be drawn one at a time (makeChoice)
+        # and retried until they happened to pass all our checks.
+        # Instead, we build a pool of candidates up front by perturbing
+        # the hints, which are correct relations:
+        #   - off-by-one coefficients (eg: x+2y=3z becomes x+3y=3z)
+        #   - a dropped term (eg: x+2y=3z becomes 2y=3z)
+        #   - a term moved to the other side (eg: x+2y=3z becomes 2y=x+3z)
+        # and draw what we need from it. Only if there are too few good
+        # candidates do we add the one-variable-per-side pairs that
+        # makeChoiceEasy draws from.
+        # Each candidate is a row of 2*num_vars coefficients: lhs then rhs.
+        num_vars = len(self.vars)
+        width = 2*num_vars
+
+        # candidate (h, kind, k) perturbs term k of hint h in one of the
+        # ways above (kind 0: one more, 1: one less, 2: dropped, 3: moved).
+        # Only one more applies to the terms a hint does not use.
+        # We only build the rows we actually draw.
+        bases = [hint.lhs + hint.rhs for hint in self.hints]
+        used = (np.array(bases) != 0)[:, np.newaxis, :] | (np.arange(4) == 0)[:, np.newaxis]
+        h, kind, k = [a.tolist() for a in np.nonzero(used)]
+        def perturbed(drawn):
+            rows = list()
+            for i in drawn:
+                row = list(bases[h[i]])
+                term = k[i]
+                if kind[i] == 0:
+                    row[term] += 1
+                elif kind[i] == 1:
+                    row[term] -= 1
+                else:
+                    if kind[i] == 3:
+                        row[(term + num_vars) % width] += row[term]
+                    row[term] = 0
+                rows.append(row)
+            return rows
+
+        # prefer perturbed hints: they look like the real thing.
+        distractors = list()
+        self.drawDistractors(len(h), perturbed, count, distractors)
+        if len(distractors) < count:
+            coeffs = np.arange(1, self.bounds.getMaxCoefficient()+1)
+            v1, v2, c1, c2 = [a.ravel() for a in np.meshgrid(np.arange(num_vars), np.arange(num_vars), coeffs, coeffs, indexing='ij')]
+            distinct = v1 != v2
+            v1, v2, c1, c2 = v1[distinct], v2[distinct], c1[distinct], c2[distinct]
+            pairs = np.zeros((len(v1), width), dtype=int)
+            pairs[np.arange(len(v1)), v1] = c1
+            pairs[np.arange(len(v1)), num_vars + v2] = c2
+            self.drawDistractors(len(pairs), lambda drawn: pairs[drawn].tolist(), count, distractors)
+        return distractors
+
+    def drawDistractors(self, num_candidates, makeRows, count, distractors):
+        # adds to 'distractors' until it has 'count' of them.
+        # makeRows(indices) returns the candidate rows at those indices,
+        # as lists.
+        # The pool may hold thousands of candidates, but we only need a
+        # few: we draw twice as many as are missing (about half of them
+        # qualify) and check only those, and draw again if that was not
+        # enough.
+        num_vars = len(self.vars)
+        max_coeff = max(self.bounds.getMaxCoefficient(), self.bounds.getMaxVariableValue())
+        tried = set()
+        while len(distractors) < count and len(tried) < num_candidates:
+            wanted = 2*(count - len(distractors))
+            if len(tried) == 0:
+                drawn = self.rng.sample(range(num_candidates), min(wanted, num_candidates))
+            else:
+                untried = [i for i in range(num_candidates) if i not in tried]
+                drawn = self.rng.sample(untried, min(wanted, len(untried)))
+            tried.update(drawn)
+            for row in makeRows(drawn):
+                if len(distractors) == count:
+                    break
+                # stay within the coefficient range our hints already use
+                if min(row) < 0 or max(row) > max_coeff:
+                    continue
+                choice = Hint(self.vars, row[:num_vars], '=', row[num_vars:])
+                if not choice.validateChoice():
+                    continue
+                # a distractor must not balance for our variable values
+                if sum((l - r)*v for l, r, v in zip(choice.lhs, choice.rhs, self.vars)) == 0:
+                    continue
+                # no hint should repeat as a choice, and
+                # no two choices must be the same!
+                if self.isUnique(distractors, choice) and not self.isIdentical(self.hints, choice):
+                    distractors.append(choice)
 
     def makeChoiceGeneric(self):
         return self.makeChoiceEasy()
@@ -334,10 +777,10 @@ class Question:
     def makeChoiceEasy(self):
         # Easy choices are basically one variable each
         num_vars = len(self.vars)
-        var1_idx=random.randint(0,num_vars-1)
-        var2_idx=random.randint(0,num_vars-1)
+        var1_idx=self.rng.randint(0,num_vars-1)
+        var2_idx=self.rng.randint(0,num_vars-1)
         while (var2_idx == var1_idx):
-            var2_idx=random.randint(0,num_vars-1)
+            var2_idx=self.rng.randint(0,num_vars-1)
         coeffs_lhs=list()
         coeffs_rhs=list()
 
@@ -345,8 +788,8 @@ class Question:
             coeffs_lhs.append(0)
             coeffs_rhs.append(0)
 
-        coeffs_lhs[var1_idx]=random.randint(1, self.bounds.getMaxCoefficient())
-        coeffs_rhs[var2_idx]=random.randint(1, self.bounds.getMaxCoefficient())
+        coeffs_lhs[var1_idx]=self.rng.randint(1, self.bounds.getMaxCoefficient())
+        coeffs_rhs[var2_idx]=self.rng.randint(1, self.bounds.getMaxCoefficient())
         return Hint(self.vars, coeffs_lhs, '=', coeffs_rhs)
 
     def sameAs(self, q):
@@ -375,23 +818,47 @@ class Question:
         else:
             return self.makeChoiceGeneric()
     
-    def makeHints(self):
+    def makeHints(self, focus=None):
+        # focus: a variable the hints should use (on the LHS), if any
         hint_list=list()
         if self.bounds.difficulty == Difficulty.EASY:
-            hint_list.append(self.makeHintEasy())
+            with self.tracer.span('makeHintEasy'):
+                hint_list.append(self.makeHintEasy(focus))
         elif self.bounds.difficulty == Difficulty.MEDIUM:
-            return self.makeHintsMedium()
+            with self.tracer.span('makeHintsMedium'):
+                return self.makeHintsMedium(focus)
+        elif self.bounds.difficulty == Difficulty.EXPERT:
+            with self.tracer.span('makeHintsExpert'):
+                return self.makeHintsExpert(focus)
         else:
-            hint_list.append(self.makeHintGeneric())
+            with self.tracer.span('makeHintGeneric'):
+                hint_list.append(self.makeHintGeneric(focus))
         return hint_list
 
-    def makeHintEasy(self):
+    def uncoveredVar(self):
+        # a random variable that no hint has used so far, if any
+        uncovered = [j for j in range(self.num_vars) if not self.used_vars[j]]
+        if len(uncovered) == 0:
+            return None
+        return self.rng.choice(uncovered)
+
+    def coversNewVar(self, hint):
+        if all(self.used_vars):
+            return True
+        for j in range (0, len(hint.lhs)):
+            if (hint.lhs[j]>0 or hint.rhs[j]>0) and not self.used_vars[j]:
+                return True
+        return False
+
+    def makeHintEasy(self, focus=None):
         # Easy hints are basically one variable each
         num_vars = len(self.vars)
-        var1_idx=random.randint(0,num_vars-1)
-        var2_idx=random.randint(0,num_vars-1)
+        var1_idx=self.rng.randint(0,num_vars-1)
+        if focus is not None:
+            var1_idx=focus
+        var2_idx=self.rng.randint(0,num_vars-1)
         while (var2_idx == var1_idx):
-            var2_idx=random.randint(0,num_vars-1)
+            var2_idx=self.rng.randint(0,num_vars-1)
         # we got two different variables
         # coefficients are assigned as inverse of variable values
         # eg: if variables have values (2 and 3), coefficients are (3 and 2).
@@ -406,17 +873,17 @@ class Question:
         coeffs_lhs[var1_idx]=self.vars[var2_idx]
         coeffs_rhs[var2_idx]=self.vars[var1_idx]
 
-        add_equal_extra = random.randint(0,2)
-        add_just_one = random.randint(0,2)
+        add_equal_extra = self.rng.randint(0,2)
+        add_just_one = self.rng.randint(0,2)
         if add_equal_extra==1:
             for i in range(num_vars):
                 if coeffs_rhs[i] == 0 and coeffs_lhs[i] == 0:
-                    coeffs_rhs[i] = coeffs_lhs[i] = random.randint(1,self.bounds.getMaxCoefficient())
+                    coeffs_rhs[i] = coeffs_lhs[i] = self.rng.randint(1,self.bounds.getMaxCoefficient())
                     if add_just_one == 1:
                         break
         return Hint(self.vars, coeffs_lhs, '=', coeffs_rhs)
         
-    def makeHintsMedium(self):
+    def makeHintsMedium(self, focus=None):
         hint_list = list()
         num_vars = len(self.vars)
         coeffs_lhs=list()
@@ -440,16 +907,21 @@ class Question:
                 if try_lhs_num_vars < num_vars:
                     try_lhs_num_vars += 1
                     num_tried = 1
+                else:
+                    # nothing balances twice within the bounds
+                    return hint_list
             for i in range(num_vars):
                 coeffs_rhs[i]=0
             try_nz=0
             for i in range (num_vars):
                 if try_nz < try_lhs_num_vars:
-                    coeffs_lhs[i] = random.randint(0,self.bounds.getMaxCoefficient())
+                    coeffs_lhs[i] = self.rng.randint(0,self.bounds.getMaxCoefficient())
                 else:
                     coeffs_lhs[i] = 0
                 if coeffs_lhs[i] != 0:
                     try_nz += 1
+            if focus is not None and coeffs_lhs[focus] == 0:
+                coeffs_lhs[focus] = self.rng.randint(1,self.bounds.getMaxCoefficient())
 
             # see if we can match this on the RHS side
             valid_rhs_found = True
@@ -489,7 +961,64 @@ class Question:
         return hint_list
         
 
-    def makeHintGeneric(self):
+    def makeHintsExpert(self, focus=None):
+        # With 10-12 variables and coefficients up to 5, the odometer
+        # search of makeHintsMedium ((max_coefficient+1)^num_vars) is out
+        # of the question. Instead we meet in the middle:
+        # we pick a small random LHS, split the remaining variables into
+        # two halves, tabulate every choice of coefficients for each half
+        # together with its weight, and join the two tables on
+        #   weight(half a) + weight(half b) == weight(LHS)
+        # As in makeHintsMedium, we favor smaller equations: of all the
+        # balancing right hand sides, we keep those with the fewest shapes.
+        hint_list = list()
+        num_vars = len(self.vars)
+        max_coeff = self.bounds.getMaxCoefficient()
+        values = np.array(self.vars)
+
+        coeffs_lhs = [0]*num_vars
+        lhs_vars = self.rng.sample(range(num_vars), self.rng.randint(2, 3))
+        if focus is not None and focus not in lhs_vars:
+            lhs_vars[0] = focus
+        for i in lhs_vars:
+            coeffs_lhs[i] = self.rng.randint(1, max_coeff)
+        target = int(np.dot(coeffs_lhs, values))
+
+        # variables on the LHS stay off the RHS,
+        # otherwise the hint would simplify.
+        rest = [i for i in range(num_vars) if coeffs_lhs[i] == 0]
+        self.rng.shuffle(rest)
+        half_a = rest[:len(rest)//2]
+        half_b = rest[len(rest)//2:]
+        grid_a = coefficientGrid(len(half_a), max_coeff)
+        grid_b = coefficientGrid(len(half_b), max_coeff)
+        sums_a = grid_a @ values[half_a]
+        sums_b = grid_b @ values[half_b]
+        shapes_a = grid_a.sum(axis=1)
+        shapes_b = grid_b.sum(axis=1)
+
+        # sort half b by weight, and by number of shapes within a weight,
+        # so the first match of every row of half a is its smallest partner.
+        order_b = np.lexsort((shapes_b, sums_b))
+        first = np.searchsorted(sums_b[order_b], target - sums_a, side='left')
+        last = np.searchsorted(sums_b[order_b], target - sums_a, side='right')
+        matched = np.flatnonzero(last > first)
+        if len(matched) == 0:
+            return hint_list
+        partner = order_b[first[matched]]
+        num_shapes = shapes_a[matched] + shapes_b[partner]
+        smallest = np.flatnonzero(num_shapes == num_shapes.min()).tolist()
+
+        for k in self.rng.sample(smallest, min(2, len(smallest))):
+            coeffs_rhs = [0]*num_vars
+            for j in range(len(half_a)):
+                coeffs_rhs[half_a[j]] = int(grid_a[matched[k], j])
+            for j in range(len(half_b)):
+                coeffs_rhs[half_b[j]] = int(grid_b[partner[k], j])
+            hint_list.append(Hint(self.vars, coeffs_lhs, '=', coeffs_rhs))
+        return hint_list
+
+    def makeHintGeneric(self, focus=None):
         # We have the variable values with us.
         # We need to get a set of coefficient values to create
         # balanced equations that satisfy lhs op rhs.
@@ -499,10 +1028,12 @@ class Question:
         lhs_sum=0
         num_vars = len(self.vars)
         for j in range (0, num_vars):
-            coeffs_lhs.append(random.randint(0, self.bounds.getMaxCoefficient()))
+            coeffs_lhs.append(self.rng.randint(0, self.bounds.getMaxCoefficient()))
+            if j == focus and coeffs_lhs[j] == 0:
+                coeffs_lhs[j] = self.rng.randint(1, self.bounds.getMaxCoefficient())
             lhs_sum+=coeffs_lhs[j]*self.vars[j]
         if self.bounds.allowInequality():
-            op_r = random.randint(0,3)
+            op_r = self.rng.randint(0,3)
             if op_r == 0:
                 op = '<'
             elif op_r == 1:
@@ -517,7 +1048,7 @@ class Question:
         coeffs_rhs=list()
         for j in range (0, num_vars):
             if not force_z:
-                coeffs_rhs.append(random.randint(0, self.bounds.getMaxCoefficient()))
+                coeffs_rhs.append(self.rng.randint(0, self.bounds.getMaxCoefficient()))
             else:
                 coeffs_rhs.append(0)
             rhs_sum += coeffs_rhs[j]*self.vars[j]
@@ -543,9 +1074,9 @@ class Question:
 
     def makeNumVars(self, bounds):
         nv = bounds.getMaxVariables()
-        if nv <= 3:
-            return 3
-        return random.randint(3, nv)
+        if nv <= bounds.getMinVariables():
+            return bounds.getMinVariables()
+        return self.rng.randint(bounds.getMinVariables(), nv)
 
     def addHint(self, hint):
         self.hints.append(hint)
@@ -558,45 +1089,192 @@ class Question:
     def addChoice(self, choice):
         self.choices.append(choice)
     def validate(self):
+        return self.rejectionReason() is None
+
+    def rejectionReason(self):
+        # why this question can not be used, or None if it can.
+        if not self.complete:
+            if len(self.hints) < self.num_vars - 1:
+                return 'hints'
+            # not enough correct choices (which must follow from
+            # the hints), or incorrect ones
+            return 'choices'
         # check that all variables have been covered
         for i in range (0, self.num_vars):
             if self.used_vars[i] == False:
-                return False
-        return True
+                return 'coverage'
+        return None
+
+class MarkedShape:
+    # We only have max_shapes shape images. Questions with more variables
+    # than that (EXPERT) reuse them with white dots in the middle: a
+    # dotted circle is a different variable than a plain circle.
+    def __init__(self, image, mark):
+        self.image = image
+        self.mark = mark
+
+    def drawOn(self, canv, x, y):
+        self.image.drawOn(canv, x, y)
+        canv.saveState()
+        canv.setFillColorRGB(1, 1, 1)
+        width = self.image.drawWidth
+        height = self.image.drawHeight
+        for m in range(self.mark):
+            dot_x = x + width*(m+1)/(self.mark+1)
+            canv.circle(dot_x, y + height/2, width/8, stroke=0, fill=1)
+        canv.restoreState()
+
+class DrawingRecorder:
+    # Stands in for the canvas while a hint or choice is drawn for the
+    # first time, and keeps the drawing calls relative to where the
+    # drawing started, so that they can be replayed anywhere later on
+    # (see DrawingCache). Translations are folded into the coordinates.
+    # Images are the bulk of a puzzle: each one becomes a form of its
+    # own, and placing it is a precomputed bit of PDF, instead of the
+    # transforms and number formatting of a drawImage call.
+    def __init__(self, x0, y0):
+        self.ops = list()
+        self.offsets = [(-x0, -y0)]
+        self.groups = list()
+        self.dx = 0
+        self.dy = 0
+
+    def saveState(self):
+        self.offsets.append(self.offsets[-1])
+        self.groups.append(len(self.ops))
+        self.ops.append(('saveState', (), {}))
+
+    def restoreState(self):
+        self.offsets.pop()
+        start = self.groups.pop()
+        # a placed image does not change the graphics state, so there
+        # is no need to save it around one (as flowables do)
+        if all(op[0] == 'image' for op in self.ops[start+1:]):
+            del self.ops[start]
+        else:
+            self.ops.append(('restoreState', (), {}))
+
+    def translate(self, dx, dy):
+        [tx, ty] = self.offsets[-1]
+        self.offsets[-1] = (tx + dx, ty + dy)
+
+    def drawImage(self, image, x, y, width=None, height=None, mask=None):
+        [tx, ty] = self.offsets[-1]
+        digest = hashlib.blake2b(repr((image, width, height, mask)).encode(), digest_size=8).hexdigest()
+        placement = 'q 1 0 0 1 %s cm' % fp_str(x + tx, y + ty)
+        self.ops.append(('image', ('bbimg' + digest, placement, image, width, height, mask), {}))
+
+    def setFillColorRGB(self, r, g, b):
+        self.ops.append(('setFillColorRGB', (r, g, b), {}))
+
+    def circle(self, x, y, r, stroke=1, fill=0):
+        [tx, ty] = self.offsets[-1]
+        self.ops.append(('circle', (x + tx, y + ty, r), {'stroke': stroke, 'fill': fill}))
+
+    def replay(self, canv, defined_forms):
+        # defined_forms: the image forms already in canv's document
+        for (op, args, kwargs) in self.ops:
+            if op == 'image':
+                [form_name, placement, image, width, height, mask] = args
+                if form_name not in defined_forms:
+                    canv.beginForm(form_name, 0, 0, width, height)
+                    canv.drawImage(image, 0, 0, width, height, mask=mask)
+                    canv.endForm()
+                    defined_forms.add(form_name)
+                canv.addLiteral(placement)
+                canv.doForm(form_name)
+                canv.addLiteral('Q')
+            else:
+                getattr(canv, op)(*args, **kwargs)
+
+class DrawingCache:
+    # Recorded drawings of puzzles, shared by all the booklets built
+    # with it (from any thread), so that a popular puzzle is laid out
+    # only once. Keyed by question fingerprint plus shape assignment;
+    # each entry maps the puzzle's hints and choices to their
+    # DrawingRecorder. The least recently used puzzles are evicted
+    # once there are more than max_entries.
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return entry
+            self.misses += 1
+            entry = dict()
+            self.entries[key] = entry
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            return entry
+
+def numQuestions(difficulty):
+    # there's no real rationale for making the
+    # number of questions to depend on difficulty level
+    # the below is just some initial set up.
+    # The way I thought about it: for kids doing EASY
+    # we may not want to dump too many questions on them.
+    if difficulty == Difficulty.EASY:
+        return 4
+    if difficulty == Difficulty.MEDIUM:
+        return 6
+    if difficulty == Difficulty.HARD:
+        return 10
+    if difficulty == Difficulty.EXPERT:
+        return 8
 
 class BB:
-    def __init__(self, difficulty, output_name):
+    def __init__(self, difficulty, output_name, tracer=None, seed=None, questions=None, workers=1, build=True, drawing_cache=None, bounds=None, num_questions=None, key_name=None):
         self.difficulty=difficulty
+        # where to write the answer key for gradeResponses(); by default
+        # next to the PDF, when the PDF goes to a file (see answerKeyPath)
+        self.key_name = key_name
+        self.num_questions = num_questions
         self.output_name = output_name
-        self.questions=list()
-        self.assemble()
-        self.build()
+        # user-defined bounds for the level, if not its preset
+        if bounds is None:
+            bounds = Bounds(self.difficulty)
+        self.bounds = bounds
+        self.drawing_cache = drawing_cache
+        if tracer is None:
+            tracer = Tracer(enabled=False)
+        self.tracer = tracer
+        if seed is None:
+            seed = newSeed()
+        self.seed = seed
+        self.workers = workers
+        if questions is None:
+            self.questions=list()
+            with self.tracer.span('BB.assemble'):
+                self.assemble()
+        else:
+            # questions were generated beforehand (see render())
+            self.questions=list(questions)
+            self.num_questions=len(self.questions)
+        if build:
+            with self.tracer.span('BB.build'):
+                self.build()
 
     def defineNumQuestions(self, difficulty):
-        # there's no real rationale for making the
-        # number of questions to depend on difficulty level
-        # the below is just some initial set up.
-        # The way I thought about it: for kids doing EASY
-        # we may not want to dump too many questions on them.
-        if difficulty == Difficulty.EASY:
-            return 4
-        if difficulty == Difficulty.MEDIUM:
-            return 6
-        if difficulty == Difficulty.HARD:
-            return 10
+        return numQuestions(difficulty)
 
     
     def assemble(self):
         info('Assembling questions ...')
-        self.num_questions = self.defineNumQuestions(self.difficulty)
-        self.bounds = Bounds(self.difficulty)
-        i=0
-        while i<self.num_questions: 
-            q=Question(self.bounds)
-            if q.validate() and self.isUniqueQuestion(q):
-                debug('Generated Question ' + str(i))
-                self.questions.append(q)
-                i+=1
+        if self.num_questions is None:
+            self.num_questions = self.defineNumQuestions(self.difficulty)
+        info('Booklet seed: ' + str(self.seed))
+        self.rejections = collections.Counter()
+        self.questions = generateQuestions(self.difficulty, self.seed, self.num_questions, self.workers, self.tracer, self.rejections, self.bounds)
+        if len(self.rejections):
+            info('Discarded questions: ' + ', '.join(reason + ': ' + str(n) for reason, n in sorted(self.rejections.items())))
 
 
     def build(self):
@@ -633,46 +1311,204 @@ class BB:
 #        pen.drawOn(c,399, 733)
 #        c.save()
 
-        if Path(self.output_name).exists():
-            warn('File: ' + self.output_name + ' already exists')
-            if os.access(self.output_name, os.W_OK)==False:
-                error('File: ' + self.output_name + ' can not be written to!')
-                sys.exit()
-        else:
-            # check if directory is writeable
-            dir_name = os.path.dirname(self.output_name)
-            if dir_name is None or dir_name=='':
-                dir_name='.'
-            if Path(dir_name).exists==False:
-                error ('Invalid directory path: ' + dir_name)
-                sys.exit()
-            if os.access(dir_name, os.W_OK) == False:
-                error('Directory: ' + dir_name +  ' can not be written to!')
-                sys.exit()
+        # the output is either a file path, or a binary sink that we
+        # write the PDF to: a BytesIO, sys.stdout.buffer, a socket...
+        sink = self.openSink(self.output_name)
 
         # Now we should be ok to write to the output.
-        c = canvas.Canvas(self.output_name, pagesize=letter)
-        c.setFont('Helvetica', 14)
-        self.pageInit()
-        t = 'Enjoy your puzzles! (Difficulty level: ' + self.toDifficultyStr(self.difficulty) + ')' 
-
-        self.writeText2PDF(c, t)
+        c = self.startCanvas(sink)
 
+        # we keep track of where each puzzle landed, so that
+        # editBooklet() can later replace just one of them.
+        self.page_ranges=list()
         for i in range (0, self.num_questions):
-            self.writeQuestionToPDF(c, self.questions[i], i+1)
-
+            self.page_ranges.append(self.writePuzzle(c, i+1))
+        self.answer_key_pages = self.writeAnswerKey(c)
+
+        # a file object we opened on the caller's socket is ours to close
+        self.finishCanvas(c, sink, close=not isinstance(sink, str) and sink is not self.output_name)
+        if isinstance(sink, str):
+            self.writeManifest(manifestPath(sink))
+        key_name = self.key_name
+        if key_name is None and isinstance(sink, str):
+            key_name = answerKeyPath(sink)
+        if key_name is not None:
+            self.writeAnswerKeyFile(key_name)
+
+    def startCanvas(self, sink):
+        self.page_idx=-1
+        # invariant: no timestamps, so a seed always gives the same file
+        c = canvas.Canvas(sink, pagesize=letter, invariant=1)
+        c.setFont('Helvetica', 14)
+        self.pageInit()
+        # forms are per document (see drawElement)
+        self.defined_forms = set()
+        return c
+
+    def finishCanvas(self, c, sink, close=False):
+        self.tracer.record('page', 'page', self.page_start, page=self.page_idx+1)
+        with self.tracer.span('canvas.save'):
+            c.save()
+            if hasattr(sink, 'flush'):
+                sink.flush()
+            if close:
+                sink.close()
+
+    def writePuzzle(self, c, q_id):
+        # writes puzzle number q_id on pages of its own,
+        # and returns the first and last of those pages.
+        first_page = c.getPageNumber()
+        if q_id == 1:
+            # the first puzzle shares its page with the title
+            t = 'Enjoy your puzzles! (Difficulty level: ' + self.toDifficultyStr(self.difficulty) + ')' 
+            self.writeText2PDF(c, t)
+
+        q = self.questions[q_id-1]
+        with self.tracer.span('writeQuestionToPDF', 'question', question=q_id):
+            # the shapes and choice order of a puzzle only
+            # depend on the booklet seed and the puzzle number
+            self.rng = streamRng(self.seed, LAYOUT_STREAM, q_id)
+            self.writeQuestionToPDF(c, q, q_id)
+
+        q.answer_numbers=list()
+        for j in range (0, len(q.displayed_choices)):
+            if q.displayed_choices[j].correct_choice:
+                q.answer_numbers.append(j+1)
+        return [first_page, c.getPageNumber()-1]
+
+    def writeAnswerKey(self, c):
+        first_page = c.getPageNumber()
         c.showPage()
-        self.writeText2PDF(c, 'Answer key:')
+        self.writeText2PDF(c, 'Answer key: (booklet seed: ' + str(self.seed) + ', booklet id: ' + self.bookletId() + ')')
         for i in range (0, self.num_questions):
             s = 'Q'+str(i+1)+': '
-            for j in range (0, len(self.questions[i].displayed_choices)):
-                choice = self.questions[i].displayed_choices[j]
-                if choice.correct_choice:
-                    s += str(j+1) + ', '
+            for n in self.questions[i].answer_numbers:
+                s += str(n) + ', '
             self.writeText2PDF(c, s)
 
         c.showPage()
-        c.save()
+        return [first_page, c.getPageNumber()-1]
+
+    def bookletId(self):
+        # Tells booklets apart when grading (see gradeResponses). The seed
+        # is not enough: the same seed is used at several levels, and an
+        # edited booklet keeps its seed. So this is a hash of everything
+        # that makes up the booklet: level, bounds, seed, and every
+        # puzzle's hints and answers.
+        puzzles = [[questionFingerprint(q), q.answer_numbers] for q in self.questions[:self.num_questions]]
+        booklet = [self.difficulty.name, sorted(self.bounds.overrides.items()), self.seed, puzzles]
+        return hashlib.blake2b(json.dumps(booklet).encode(), digest_size=6).hexdigest()
+
+    def answerKey(self):
+        # the answer key in machine-readable form, for gradeResponses().
+        # Booklets are told apart by their id (see bookletId).
+        puzzles=list()
+        for i in range (0, self.num_questions):
+            q = self.questions[i]
+            puzzles.append({
+                'choices': q.num_choices,
+                'answers': q.answer_numbers,
+            })
+        return {
+            'id': self.bookletId(),
+            'seed': self.seed,
+            'difficulty': self.difficulty.name,
+            'puzzles': puzzles,
+        }
+
+    def writeAnswerKeyFile(self, key_name):
+        with open(key_name, 'w') as f:
+            json.dump(self.answerKey(), f, indent=1)
+
+    def writeManifest(self, manifest_name):
+        # what editBooklet() needs to know about the booklet:
+        # where each question comes from, its pages and its answers.
+        questions=list()
+        for i in range (0, self.num_questions):
+            q = self.questions[i]
+            if getattr(q, 'index', None) is None or q.seed != self.seed:
+                # not generated from the booklet's seed (eg: handed to
+                # render(), or by a QuestionReservoir): we could not
+                # recreate it
+                return
+            questions.append({
+                'index': q.index,
+                'attempt': q.attempt,
+                'pages': self.page_ranges[i],
+                'answers': q.answer_numbers,
+            })
+        manifest = {
+            'difficulty': self.difficulty.name,
+            'bounds': self.bounds.overrides,
+            'seed': self.seed,
+            'questions': questions,
+            'answer_key_pages': self.answer_key_pages,
+        }
+        with open(manifest_name, 'w') as f:
+            json.dump(manifest, f, indent=1)
+
+    def rebuildPuzzle(self, puzzle_number, manifest):
+        # Renders puzzle_number and the answer key on their own, and
+        # splices them in between the unchanged pages of the existing PDF.
+        with open(self.output_name, 'rb') as f:
+            old = pypdf.PdfReader(io.BytesIO(f.read()))
+
+        puzzle_pdf = io.BytesIO()
+        c = self.startCanvas(puzzle_pdf)
+        self.writePuzzle(c, puzzle_number)
+        self.finishCanvas(c, puzzle_pdf)
+
+        key_pdf = io.BytesIO()
+        c = self.startCanvas(key_pdf)
+        self.writeAnswerKey(c)
+        self.finishCanvas(c, key_pdf)
+
+        writer = pypdf.PdfWriter()
+        self.page_ranges=list()
+        for i in range (0, self.num_questions):
+            first_page = len(writer.pages)+1
+            if i == puzzle_number-1:
+                for page in pypdf.PdfReader(puzzle_pdf).pages:
+                    writer.add_page(page)
+            else:
+                [first, last] = manifest['questions'][i]['pages']
+                for page_idx in range (first-1, last):
+                    writer.add_page(old.pages[page_idx])
+            self.page_ranges.append([first_page, len(writer.pages)])
+        first_page = len(writer.pages)+1
+        for page in pypdf.PdfReader(key_pdf).pages:
+            writer.add_page(page)
+        self.answer_key_pages = [first_page, len(writer.pages)]
+
+        with self.tracer.span('canvas.save'):
+            writer.write(self.output_name)
+        self.writeManifest(manifestPath(self.output_name))
+        self.writeAnswerKeyFile(answerKeyPath(self.output_name))
+
+    def openSink(self, output):
+        if not isinstance(output, (str, os.PathLike)):
+            if hasattr(output, 'write'):
+                return output
+            if hasattr(output, 'makefile'):
+                # a socket: write to it as a file
+                return output.makefile('wb')
+            raise BBError('Output must be a file path or a writeable binary stream')
+
+        output = os.fspath(output)
+        if Path(output).exists():
+            warn('File: ' + output + ' already exists')
+            if os.access(output, os.W_OK)==False:
+                raise BBError('File: ' + output + ' can not be written to!')
+        else:
+            # check if directory is writeable
+            dir_name = os.path.dirname(output)
+            if dir_name is None or dir_name=='':
+                dir_name='.'
+            if Path(dir_name).exists()==False:
+                raise BBError('Invalid directory path: ' + dir_name)
+            if os.access(dir_name, os.W_OK) == False:
+                raise BBError('Directory: ' + dir_name +  ' can not be written to!')
+        return output
 
     def writeQuestionToPDF(self, canv, q, q_id):
         # A question comprises a header, hints and choices
@@ -682,6 +1518,9 @@ class BB:
 
         # assign shapes to coefficients
         self.assignShapeImages(q.num_vars)
+        if self.drawing_cache is not None:
+            self.puzzle_key = (questionFingerprint(q), tuple(self.shape_names))
+            self.puzzle_drawing = self.drawing_cache.lookup(self.puzzle_key)
 
         use_extra_page = False
         total_height=self.text_height 
@@ -722,7 +1561,7 @@ class BB:
             self.writeText2PDFRaw(canv, self.x, self.y - self.choice_height/2, '('+str(c_idx+1)+')')
             self.y -= self.choice_height 
             self.x += self.choice_number_width
-            self.writeChoice(canv, choice)
+            self.drawElement(canv, ('choice', tuple(choice.lhs), choice.op, tuple(choice.rhs)), lambda target: self.writeChoice(target, choice))
             self.y -= self.spacing
             self.x = self.left_margin
 
@@ -737,7 +1576,7 @@ class BB:
         q.displayed_choices = t_choices
     def randomizeChoices(self, choices):
         n_c = len(choices)
-        rand_offset = random.randint(1, n_c)
+        rand_offset = self.rng.randint(1, n_c)
         out_choices=list()
         for idx in range (0, n_c):
             out_choices.append(choices[(idx+rand_offset) % n_c])
@@ -745,9 +1584,37 @@ class BB:
 
 
     def writeHint(self, canv, hint):
-        bal = "../images/balance2.jpg"
-        im = Image(bal, 5.5*inch, 0.75*inch)
         self.x = self.left_margin
+        self.drawElement(canv, ('hint', tuple(hint.lhs), hint.op, tuple(hint.rhs)), lambda target: self.drawHint(target, hint))
+
+    def drawElement(self, canv, key, draw):
+        # Draws one hint or choice of the current puzzle, by calling
+        # draw(canvas), which moves self.x and self.y along as it goes.
+        # With a drawing cache, the drawing calls are recorded the first
+        # time the puzzle is drawn in any booklet, and replayed from
+        # then on, without working out the layout again.
+        if self.drawing_cache is None:
+            draw(canv)
+            return
+        x0 = self.x
+        y0 = self.y
+        recording = self.puzzle_drawing.get(key)
+        if recording is None:
+            recording = DrawingRecorder(x0, y0)
+            draw(recording)
+            recording.dx = self.x - x0
+            recording.dy = self.y - y0
+            self.puzzle_drawing[key] = recording
+        canv.saveState()
+        canv.translate(x0, y0)
+        recording.replay(canv, self.defined_forms)
+        canv.restoreState()
+        self.x = x0 + recording.dx
+        self.y = y0 + recording.dy
+
+    def drawHint(self, canv, hint):
+        bal = imagePath('balance2.jpg')
+        im = self.loadImage(bal, 5.5*inch, 0.75*inch)
         y=self.y
         im.drawOn(canv, self.x, self.y-self.hint_height)
 
@@ -808,27 +1675,37 @@ class BB:
 
     def assignShapeImages(self, num_vars):
         self.shapes=list()
-        self.equals_shape=Image("../images/equals.jpg", 0.4*inch, 0.4*inch)
-        rand_offset = random.randint(0, self.max_shapes)
+        self.shape_names=list()
+        self.equals_shape=self.loadImage(imagePath('equals.jpg'), 0.4*inch, 0.4*inch)
+        rand_offset = self.rng.randint(0, self.max_shapes)
         for idx in range (0, num_vars):
             r_idx = (idx + rand_offset) % self.max_shapes
+            # past max_shapes variables, shapes get reused with a mark
+            mark = idx // self.max_shapes
             if r_idx == 0:
-                image = "../images/circle.jpg"
+                image = imagePath('circle.jpg')
             elif r_idx == 1:
-                image = "../images/pentagon.jpg"
+                image = imagePath('pentagon.jpg')
             elif r_idx == 2:
-                image = "../images/triangle.jpg"
+                image = imagePath('triangle.jpg')
             elif r_idx == 3:
-                image = "../images/hexagon.jpg"
+                image = imagePath('hexagon.jpg')
             elif r_idx == 4:
-                image = "../images/square.jpg"
+                image = imagePath('square.jpg')
             elif r_idx == 5:
-                image = "../images/diamond.jpg"
+                image = imagePath('diamond.jpg')
             else:
                 error('Unsupported index: No shape available')
                 image = None
-            shape = Image(image, 0.4*inch, 0.4*inch)
+            shape = self.loadImage(image, 0.4*inch, 0.4*inch)
+            if mark > 0:
+                shape = MarkedShape(shape, mark)
             self.shapes.append(shape)
+            self.shape_names.append((os.path.basename(image), mark))
+
+    def loadImage(self, image, width, height):
+        with self.tracer.span('loadImage', 'image', image=image):
+            return Image(image, width, height)
 
     def writeChoice(self, canv, choice):
         var_idx=0
@@ -858,7 +1735,10 @@ class BB:
 
 
     def pageInit(self):
+        if self.page_idx >= 0:
+            self.tracer.record('page', 'page', self.page_start, page=self.page_idx+1)
         self.page_idx+=1
+        self.page_start = self.tracer.now()
         self.page_width = letter[0]
         self.page_height = letter[1]
         self.text_height=15
@@ -899,24 +1779,1015 @@ class BB:
             return 'Medium'
         elif level == Difficulty.HARD:
             return 'Hard'
+        elif level == Difficulty.EXPERT:
+            return 'Expert'
         else:
             return 'Unknown'
 
 
     def isUniqueQuestion(self, q):
-        # verify that we don't have any repeat questions!
-        # However rare this may be, we simply can not allow this.
-        # Unless we want to be left red-faced when a kid calls up
-        # and says she got a set of duplicate puzzles!
-        for ques in self.questions:
-            if ques.sameAs(q):
-                return False
+        return isUniqueQuestion(self.questions, q)
+
+
+def isUniqueQuestion(questions, q):
+    # verify that we don't have any repeat questions!
+    # However rare this may be, we simply can not allow this.
+    # Unless we want to be left red-faced when a kid calls up
+    # and says she got a set of duplicate puzzles!
+    for ques in questions:
+        if ques.sameAs(q):
+            return False
 
+    return True
+
+def questionFingerprint(q):
+    # A 64 bit fingerprint that two questions share if they have the
+    # same hints, each up to a scale factor (as in Hint.sameAs).
+    # Never 0, so that 0 can mark an empty slot.
+    rows = list()
+    for hint in q.hints:
+        diff = [l - r for l, r in zip(hint.lhs, hint.rhs)]
+        scale = math.gcd(*diff)
+        if scale == 0:
+            scale = 1
+        nz = [d for d in diff if d != 0]
+        if len(nz) and nz[0] < 0:
+            scale = -scale
+        rows.append(tuple(d // scale for d in diff))
+    digest = hashlib.blake2b(repr(sorted(rows)).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'little') or 1
+
+class SharedQuestionStore:
+    # A pool of generated questions of one difficulty level, shared by
+    # all worker processes through one block of shared memory, along
+    # with one uniqueness index over all of them.
+    # Questions are kept as numpy arrays of coefficients (a few hundred
+    # bytes each) instead of one copy of Python objects per worker, so
+    # memory stays flat as workers are added.
+    #
+    # append() puts a question in the pool unless an equal one is there,
+    # claim() takes the oldest unclaimed question out of it, for any
+    # process. CPython gives us no atomic compare-and-swap on shared
+    # memory, so both take one multiprocessing lock, held only to reserve
+    # a slot (counters and fingerprint table); the coefficients are
+    # copied in and out outside of the lock.
+    #
+    # Hand the store itself to multiprocessing.Process as an argument:
+    # the child attaches to the same shared memory and lock.
+    OPS = ['', '=', '<', '>']
+
+    def __init__(self, difficulty, capacity, name=None, lock=None, bounds=None):
+        self.difficulty = difficulty
+        self.capacity = capacity
+        if bounds is None:
+            bounds = Bounds(difficulty)
+        self.bounds = bounds
+        v = bounds.getMaxVariables()
+        h = v - 1
+        c = bounds.num_choices
+        # the fingerprint table is an open addressing hash table,
+        # twice as large as the pool so that probe chains stay short.
+        fields = [
+            ('counters', np.int64, (2,)),
+            ('fingerprints', np.uint64, (2*capacity,)),
+            ('keys', np.int64, (capacity, 3)),
+            ('ready', np.int8, (capacity,)),
+            ('vars', np.int8, (capacity, v)),
+            ('hint_lhs', np.int8, (capacity, h, v)),
+            ('hint_rhs', np.int8, (capacity, h, v)),
+            ('hint_ops', np.int8, (capacity, h)),
+            ('choice_lhs', np.int8, (capacity, c, v)),
+            ('choice_rhs', np.int8, (capacity, c, v)),
+            ('choice_ops', np.int8, (capacity, c)),
+            ('choice_correct', np.int8, (capacity, c)),
+        ]
+        size = 0
+        for (field, dtype, shape) in fields:
+            size += int(np.prod(shape)) * np.dtype(dtype).itemsize
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+            self.lock = multiprocessing.Lock()
+            self.owner = True
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.lock = lock
+            self.owner = False
+        offset = 0
+        for (field, dtype, shape) in fields:
+            array = np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=offset)
+            setattr(self, field, array)
+            offset += array.nbytes
+        if self.owner:
+            self.shm.buf[:size] = bytes(size)
+
+    def __getstate__(self):
+        return (self.difficulty, self.capacity, self.shm.name, self.lock, self.bounds)
+
+    def __setstate__(self, state):
+        [difficulty, capacity, name, lock, bounds] = state
+        self.__init__(difficulty, capacity, name, lock, bounds)
+
+    def count(self):
+        return int(self.counters[0])
+
+    def claimedCount(self):
+        return int(self.counters[1])
+
+    def append(self, q):
+        # False if the pool is full, or already has an equal question.
+        fingerprint = np.uint64(questionFingerprint(q))
+        with self.lock:
+            slot = self.counters[0]
+            if slot >= self.capacity:
+                return False
+            t = int(fingerprint % np.uint64(len(self.fingerprints)))
+            while self.fingerprints[t] != 0:
+                if self.fingerprints[t] == fingerprint:
+                    return False
+                t = (t + 1) % len(self.fingerprints)
+            self.fingerprints[t] = fingerprint
+            self.counters[0] += 1
+
+        self.keys[slot] = [getattr(q, 'seed', -1), getattr(q, 'index', -1), getattr(q, 'attempt', -1)]
+        self.vars[slot] = 0
+        self.vars[slot, :q.num_vars] = q.vars
+        self.writeRelations(q.hints, self.hint_lhs[slot], self.hint_rhs[slot], self.hint_ops[slot])
+        self.writeRelations(q.choices, self.choice_lhs[slot], self.choice_rhs[slot], self.choice_ops[slot])
+        self.choice_correct[slot] = 0
+        for j in range(len(q.choices)):
+            self.choice_correct[slot, j] = q.choices[j].correct_choice
+        # readers only look at a slot once it is marked ready
+        self.ready[slot] = 1
         return True
-    
 
-def main(difficulty_level, output_name):
-    BB(difficulty_level, output_name)
+    def writeRelations(self, relations, lhs, rhs, ops):
+        lhs[:] = 0
+        rhs[:] = 0
+        ops[:] = 0
+        for j in range(len(relations)):
+            n = len(relations[j].lhs)
+            lhs[j, :n] = relations[j].lhs
+            rhs[j, :n] = relations[j].rhs
+            ops[j] = self.OPS.index(relations[j].op)
+
+    def readRelations(self, num_vars, lhs, rhs, ops, correct=None):
+        relations = list()
+        for j in range(len(ops)):
+            if ops[j] == 0:
+                break
+            is_correct = bool(correct[j]) if correct is not None else False
+            relations.append((lhs[j, :num_vars].tolist(), self.OPS[ops[j]], rhs[j, :num_vars].tolist(), is_correct))
+        return relations
+
+    def claim(self):
+        # the oldest unclaimed question, or None if there is none
+        # (or it is still being copied in by its process).
+        with self.lock:
+            slot = self.counters[1]
+            if slot >= self.counters[0] or not self.ready[slot]:
+                return None
+            self.counters[1] += 1
+
+        num_vars = int(np.count_nonzero(self.vars[slot]))
+        record = {
+            'vars': self.vars[slot, :num_vars].tolist(),
+            'hints': self.readRelations(num_vars, self.hint_lhs[slot], self.hint_rhs[slot], self.hint_ops[slot]),
+            'choices': self.readRelations(num_vars, self.choice_lhs[slot], self.choice_rhs[slot], self.choice_ops[slot], self.choice_correct[slot]),
+        }
+        q = Question(self.bounds, record=record)
+        [q.seed, q.index, q.attempt] = self.keys[slot].tolist()
+        return q
+
+    def close(self):
+        # every process closes its own view; the creator also frees it.
+        for (field, value) in list(self.__dict__.items()):
+            if isinstance(value, np.ndarray):
+                delattr(self, field)
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+def fillQuestionStore(store, seed, indices):
+    # worker process body: generate the questions at the given indices
+    # of the seed's stream (see makeQuestion) into the shared store.
+    # Returns how many of them the store took.
+    added = 0
+    for index in indices:
+        attempt = 0
+        while True:
+            q = makeQuestion(store.difficulty, seed, index, attempt, bounds=store.bounds)
+            if q.validate():
+                break
+            attempt += 1
+        if store.append(q):
+            added += 1
+    return added
+
+def makeQuestion(difficulty, seed, index, attempt, tracer=None, bounds=None):
+    # The question is fully determined by the arguments.
+    # It may still be invalid, in which case the next attempt is tried.
+    # bounds: user-defined bounds for the level, if not its preset
+    if bounds is None:
+        bounds = Bounds(difficulty)
+    rng = streamRng(seed, QUESTION_STREAM, difficulty.value, index, attempt)
+    q = Question(bounds, tracer, rng)
+    q.seed = seed
+    q.index = index
+    q.attempt = attempt
+    return q
+
+def findQuestion(difficulty, seed, index, earlier=(), attempt=0, tracer=None, stats=None, bounds=None):
+    # The question at 'index' of a booklet is its first attempt that
+    # is valid and does not repeat any of the earlier questions.
+    # stats (a collections.Counter), if given, counts the discarded
+    # attempts by reason (see Question.rejectionReason).
+    if tracer is None:
+        tracer = Tracer(enabled=False)
+    while True:
+        with tracer.span('Question.__init__', 'question', question=index+1, attempt=attempt):
+            q = makeQuestion(difficulty, seed, index, attempt, tracer, bounds)
+        reason = q.rejectionReason()
+        if reason is None and not isUniqueQuestion(earlier, q):
+            reason = 'repeat'
+        if reason is None:
+            return q
+        if stats is not None:
+            stats[reason] += 1
+        attempt += 1
+
+def firstValidAttempt(difficulty, seed, index, bounds=None):
+    # runs in worker processes: only the attempt number (and why the
+    # attempts before it were discarded) travels back, the question
+    # itself is cheap to rebuild from it.
+    attempt = 0
+    stats = collections.Counter()
+    while True:
+        reason = makeQuestion(difficulty, seed, index, attempt, bounds=bounds).rejectionReason()
+        if reason is None:
+            return attempt, stats
+        stats[reason] += 1
+        attempt += 1
+
+def iterQuestions(difficulty, seed=None, tracer=None, stats=None, bounds=None):
+    # Library entry point: yields an endless stream of valid questions
+    # for the difficulty level, none of which repeats an earlier one.
+    # The stream is fully determined by the seed, and each question
+    # draws from its own generator, so iterators running in different
+    # threads are independent of each other.
+    #
+    # eg: questions = list(itertools.islice(iterQuestions(Difficulty.HARD, seed=7), 10))
+    checkBounds(bounds)
+    if seed is None:
+        seed = newSeed()
+    questions = list()
+    for index in itertools.count():
+        q = findQuestion(difficulty, seed, index, questions, tracer=tracer, stats=stats, bounds=bounds)
+        questions.append(q)
+        yield q
+
+def generateQuestions(difficulty, seed, count, workers=1, tracer=None, stats=None, bounds=None):
+    # The first 'count' questions of iterQuestions(difficulty, seed).
+    # With more than one worker, the (independent) search for each
+    # question's first valid attempt is spread over processes; repeats
+    # are then resolved in order, exactly as iterQuestions does, so the
+    # result is identical to generating serially.
+    if workers <= 1:
+        return list(itertools.islice(iterQuestions(difficulty, seed, tracer, stats, bounds), count))
+    checkBounds(bounds)
+    with ProcessPoolExecutor(workers) as pool:
+        first_attempts = list(pool.map(firstValidAttempt, [difficulty]*count, [seed]*count, range(count), [bounds]*count))
+    questions = list()
+    for index in range(count):
+        [attempt, worker_stats] = first_attempts[index]
+        if stats is not None:
+            stats.update(worker_stats)
+        questions.append(findQuestion(difficulty, seed, index, questions, attempt, tracer, stats, bounds))
+    return questions
+
+def checkBounds(bounds):
+    # refuse bounds within which questions can not be made,
+    # rather than search for them forever.
+    if bounds is None:
+        return
+    reason = bounds.infeasibleReason()
+    if reason is not None:
+        raise BBError('Infeasible bounds: ' + reason)
+
+class CostEstimate:
+    # What making questions within some bounds costs, measured on a
+    # sample of them (see estimateCost).
+    def __init__(self, bounds, count):
+        self.bounds = bounds
+        # questions per booklet
+        self.count = count
+        self.questions = 0
+        self.attempts = 0
+        self.hints = 0
+        self.hint_tries = 0
+        self.seconds = 0.0
+        self.rejections = collections.Counter()
+        # why the bounds are refused, or None if they are not
+        self.reason = None
+
+    def feasible(self):
+        return self.reason is None
+
+    def attemptsPerHint(self):
+        if self.hints == 0:
+            return math.inf
+        return self.hint_tries / self.hints
+
+    def attemptsPerQuestion(self):
+        if self.questions == 0:
+            return math.inf
+        return self.attempts / self.questions
+
+    def secondsPerBooklet(self):
+        # question generation only: repeats are rare, and
+        # rendering does not depend much on the bounds.
+        if self.questions == 0:
+            return math.inf
+        return self.seconds / self.questions * self.count
+
+    def summary(self):
+        bounds = self.bounds
+        lines = list()
+        lines.append('Bounds (' + bounds.difficulty.name + '): ' + ', '.join(name + '=' + str(getattr(bounds, name)) for name in Bounds.names))
+        lines.append('Sampled: %d valid questions in %d attempts (%.3fs)' % (self.questions, self.attempts, self.seconds))
+        if len(self.rejections):
+            lines.append('Discarded: ' + ', '.join(reason + ': ' + str(n) for reason, n in sorted(self.rejections.items())))
+        lines.append('Attempts per hint: %.2f' % self.attemptsPerHint())
+        lines.append('Attempts per question: %.2f' % self.attemptsPerQuestion())
+        lines.append('Expected seconds per booklet of %d: %.3f' % (self.count, self.secondsPerBooklet()))
+        if self.reason is not None:
+            lines.append('Refused: ' + self.reason)
+        return lines
+
+    def printSummary(self):
+        for line in self.summary():
+            info(line)
+
+def estimateCost(bounds, count=None, samples=8, seed=0, time_budget=5.0, max_seconds=120.0):
+    # Makes questions within the bounds for at most time_budget seconds,
+    # and predicts from them what a booklet of count questions costs.
+    # The bounds are refused (see CostEstimate.reason) if they are
+    # infeasible (see Bounds.infeasibleReason), if no valid question
+    # turns up, or if a booklet would take more than max_seconds.
+    if count is None:
+        count = numQuestions(bounds.difficulty)
+    estimate = CostEstimate(bounds, count)
+    estimate.reason = bounds.infeasibleReason()
+    if estimate.reason is not None:
+        return estimate
+    start = time.perf_counter()
+    out_of_time = False
+    for index in range(samples):
+        attempt = 0
+        while not out_of_time:
+            t = time.perf_counter()
+            q = makeQuestion(bounds.difficulty, seed, index, attempt, bounds=bounds)
+            reason = q.rejectionReason()
+            estimate.seconds += time.perf_counter() - t
+            estimate.attempts += 1
+            estimate.hints += len(q.hints)
+            estimate.hint_tries += q.hint_tries
+            out_of_time = time.perf_counter() - start > time_budget
+            if reason is None:
+                estimate.questions += 1
+                break
+            estimate.rejections[reason] += 1
+            attempt += 1
+        if out_of_time:
+            break
+    if estimate.questions == 0:
+        estimate.reason = 'no valid question in %d attempts (%.1fs)' % (estimate.attempts, estimate.seconds)
+    elif estimate.secondsPerBooklet() > max_seconds:
+        estimate.reason = 'a booklet would take about %.1fs to make (more than %.1fs)' % (estimate.secondsPerBooklet(), max_seconds)
+    return estimate
+
+def manifestPath(output_name):
+    # booklet.pdf is described by booklet.bb.json
+    return os.path.splitext(output_name)[0] + '.bb.json'
+
+def answerKeyPath(output_name):
+    # and its answers are in booklet.key.json
+    return os.path.splitext(output_name)[0] + '.key.json'
+
+def editBooklet(output_name, puzzle_number, tracer=None):
+    # Replaces puzzle number puzzle_number of a booklet that BB wrote
+    # to output_name earlier with a new puzzle that repeats none of the
+    # others (nor the one it replaces). Only the new puzzle's pages and
+    # the answer key are rendered; the other pages are copied over from
+    # the existing PDF. Without pypdf we can not copy pages, so the
+    # booklet is rendered again from its seed instead, which leaves
+    # the other puzzles unchanged too.
+    manifest_name = manifestPath(output_name)
+    if not os.path.exists(manifest_name) or not os.path.exists(output_name):
+        raise BBError('No booklet to edit at: ' + output_name + ' (with ' + manifest_name + ')')
+    with open(manifest_name) as f:
+        manifest = json.load(f)
+    difficulty = Difficulty[manifest['difficulty']]
+    bounds = Bounds(difficulty, **manifest.get('bounds', {}))
+    seed = manifest['seed']
+    entries = manifest['questions']
+    if puzzle_number < 1 or puzzle_number > len(entries):
+        raise BBError('Puzzle number must be between 1 and ' + str(len(entries)))
+
+    info('Replacing puzzle ' + str(puzzle_number) + ' of: ' + output_name)
+    questions=list()
+    for entry in entries:
+        q = makeQuestion(difficulty, seed, entry['index'], entry['attempt'], bounds=bounds)
+        q.answer_numbers = entry['answers']
+        questions.append(q)
+    k = puzzle_number-1
+    others = questions[:k] + questions[k+1:] + [questions[k]]
+    questions[k] = findQuestion(difficulty, seed, entries[k]['index'], others, entries[k]['attempt']+1, tracer, bounds=bounds)
+
+    booklet = BB(difficulty, output_name, tracer, seed=seed, questions=questions, build=False, bounds=bounds)
+    if pypdf is None:
+        warn('pypdf is not installed: building the whole booklet again')
+        booklet.build()
+    else:
+        booklet.rebuildPuzzle(puzzle_number, manifest)
+    return booklet
+
+def render(questions, sink, seed=None, tracer=None, drawing_cache=None):
+    # Library entry point: lays out already generated questions
+    # (eg: from iterQuestions) as a booklet and writes the PDF to sink,
+    # a file path or any binary stream (eg: io.BytesIO, a socket).
+    # Returns the BB instance, whose questions now carry displayed_choices.
+    questions = list(questions)
+    if len(questions) == 0:
+        raise BBError('No questions to render')
+    bounds = questions[0].bounds
+    return BB(bounds.difficulty, sink, tracer=tracer, seed=seed, questions=questions, drawing_cache=drawing_cache, bounds=bounds)
+
+class QuestionReservoir:
+    # Questions of one difficulty level made ahead of time, so that a
+    # booklet is served in O(count) no matter how long its questions take
+    # to make (eg: for interactive users). A background thread keeps the
+    # reservoir topped up to high_water valid questions, no two of which
+    # are the same (see questionFingerprint), so that a booklet taken
+    # from it has no repeats either.
+    #
+    # eg: reservoir = QuestionReservoir(Difficulty.HARD, high_water=100)
+    #     reservoir.start()
+    #     render(reservoir.take(10), sink)
+    #
+    # The thread shares the interpreter with the callers; the questions
+    # are taken under a lock held only to pop them, so a request waits
+    # at most for the thread to let go of the interpreter.
+    def __init__(self, difficulty, high_water=64, seed=None, bounds=None, tracer=None):
+        self.difficulty = difficulty
+        self.high_water = high_water
+        if seed is None:
+            seed = newSeed()
+        self.seed = seed
+        if bounds is None:
+            bounds = Bounds(difficulty)
+        checkBounds(bounds)
+        self.bounds = bounds
+        if tracer is None:
+            tracer = Tracer(enabled=False)
+        self.tracer = tracer
+        self.questions = collections.deque()
+        self.fingerprints = set()
+        self.condition = threading.Condition()
+        self.thread = None
+        self.stopped = False
+        # what stopped the background thread, if it failed
+        self.error = None
+        # metrics (see metrics())
+        self.next_index = 0
+        self.generated = 0
+        self.served = 0
+        self.duplicates = 0
+        self.waits = 0
+        self.rejections = collections.Counter()
+        self.refills = collections.deque(maxlen=256)
+        self.refill_seconds = 0.0
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.refill, name='QuestionReservoir ' + self.difficulty.name, daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def depth(self):
+        return len(self.questions)
+
+    def refill(self):
+        # background thread body. If making questions fails, the error
+        # is kept for take() and metrics() to raise, rather than leave
+        # them waiting for questions that will never come.
+        try:
+            self.refillLoop()
+        except Exception as e:
+            with self.condition:
+                self.error = e
+                self.condition.notify_all()
+
+    def checkError(self):
+        # with self.condition held
+        if self.error is not None:
+            raise BBError('Question reservoir failed: ' + type(self.error).__name__ + ': ' + str(self.error)) from self.error
+
+    def refillLoop(self):
+        # each question comes from the next index of the reservoir's
+        # seed (see makeQuestion), like a booklet's do, except that
+        # repeats are checked against what is in the reservoir rather
+        # than against earlier questions.
+        while True:
+            with self.condition:
+                while not self.stopped and len(self.questions) >= self.high_water:
+                    self.condition.wait()
+                if self.stopped:
+                    return
+                index = self.next_index
+                self.next_index += 1
+            start = time.perf_counter()
+            attempt = 0
+            rejections = collections.Counter()
+            with self.tracer.span('QuestionReservoir.refill', 'reservoir', question=index):
+                while True:
+                    q = makeQuestion(self.difficulty, self.seed, index, attempt, bounds=self.bounds)
+                    reason = q.rejectionReason()
+                    if reason is None:
+                        break
+                    rejections[reason] += 1
+                    attempt += 1
+            fingerprint = questionFingerprint(q)
+            with self.condition:
+                self.rejections.update(rejections)
+                self.refill_seconds += time.perf_counter() - start
+                if fingerprint in self.fingerprints:
+                    self.duplicates += 1
+                    continue
+                self.fingerprints.add(fingerprint)
+                q.fingerprint = fingerprint
+                self.questions.append(q)
+                self.generated += 1
+                self.refills.append(time.perf_counter())
+                self.condition.notify_all()
+
+    def take(self, count, timeout=None):
+        # the oldest count questions, waiting for the reservoir to
+        # have them if need be (at most timeout seconds, if given).
+        if count > self.high_water:
+            raise BBError('Can not take ' + str(count) + ' questions from a reservoir of ' + str(self.high_water))
+        with self.condition:
+            if len(self.questions) < count:
+                self.checkError()
+                if self.thread is None:
+                    raise BBError('Question reservoir is not running (see QuestionReservoir.start)')
+                self.waits += 1
+                if not self.condition.wait_for(lambda: len(self.questions) >= count or self.stopped or self.error is not None, timeout):
+                    raise BBError('Timed out waiting for ' + str(count) + ' questions (' + str(len(self.questions)) + ' ready)')
+                if len(self.questions) < count:
+                    self.checkError()
+                    raise BBError('Question reservoir was stopped')
+            questions = list()
+            for i in range(count):
+                q = self.questions.popleft()
+                self.fingerprints.discard(q.fingerprint)
+                questions.append(q)
+            self.served += count
+            self.condition.notify_all()
+        return questions
+
+    def refillRate(self):
+        # questions per second, over the last (up to 256) refills
+        with self.condition:
+            if len(self.refills) < 2:
+                return 0.0
+            return (len(self.refills) - 1) / (self.refills[-1] - self.refills[0])
+
+    def metrics(self):
+        with self.condition:
+            self.checkError()
+            mean_seconds = self.refill_seconds / max(1, self.generated + self.duplicates)
+            metrics = {
+                'difficulty': self.difficulty.name,
+                'depth': len(self.questions),
+                'high_water': self.high_water,
+                'generated': self.generated,
+                'served': self.served,
+                'duplicates': self.duplicates,
+                'waits': self.waits,
+                'rejections': dict(self.rejections),
+                'seconds_per_question': mean_seconds,
+            }
+        metrics['refill_rate'] = self.refillRate()
+        return metrics
+
+def readBatchJobs(jobs_name):
+    # A batch manifest has one job per line, as a JSON object:
+    #   {"difficulty": 3, "count": 10, "seed": 7, "output": "week1.pdf"}
+    # difficulty is a level number or name, count (the number of puzzles)
+    # and seed are optional, and so is "bounds" (see Bounds). Relative
+    # output paths are relative to the manifest. Every job is checked
+    # before any of them runs, and custom bounds are refused unless
+    # estimateCost() finds them workable, as for the CLI's -bounds.
+    jobs = list()
+    outputs = set()
+    estimates = dict()
+    with open(jobs_name) as f:
+        lines = f.readlines()
+    for line_number, line in enumerate(lines, 1):
+        if line.strip() == '':
+            continue
+        where = jobs_name + ':' + str(line_number) + ': '
+        try:
+            spec = json.loads(line)
+        except ValueError as e:
+            raise BBError(where + 'not valid JSON (' + str(e) + ')')
+        if not isinstance(spec, dict) or not isinstance(spec.get('output'), str):
+            raise BBError(where + 'a job needs an "output"')
+        level = spec.get('difficulty')
+        try:
+            if isinstance(level, str):
+                difficulty = Difficulty[level.upper()]
+            else:
+                difficulty = Difficulty(level)
+        except (KeyError, ValueError):
+            raise BBError(where + 'difficulty must be 1, 2, 3 or 4 (or EASY, MEDIUM, HARD or EXPERT)')
+        count = spec.get('count')
+        if count is not None and (not isinstance(count, int) or count < 1):
+            raise BBError(where + 'count must be a positive integer')
+        seed = spec.get('seed')
+        if seed is not None and (not isinstance(seed, int) or seed < 0):
+            raise BBError(where + 'seed must be a non-negative integer')
+        overrides = spec.get('bounds', {})
+        if not isinstance(overrides, dict):
+            raise BBError(where + 'bounds must be an object, eg: {"max_variables": 5}')
+        try:
+            bounds = Bounds(difficulty, **overrides)
+        except BBError as e:
+            raise BBError(where + str(e))
+        if bounds.isCustom():
+            # jobs often share their bounds: estimate each of them once
+            estimate_key = (difficulty, json.dumps(overrides, sort_keys=True))
+            if estimate_key not in estimates:
+                estimates[estimate_key] = estimateCost(bounds)
+            reason = estimates[estimate_key].reason
+        else:
+            reason = bounds.infeasibleReason()
+        if reason is not None:
+            raise BBError(where + 'refusing bounds: ' + reason)
+        output_name = os.path.join(os.path.dirname(os.path.abspath(jobs_name)), spec['output'])
+        if output_name in outputs:
+            raise BBError(where + 'another job already writes to: ' + spec['output'])
+        outputs.add(output_name)
+        jobs.append({
+            'line': line_number,
+            'output': spec['output'],
+            'output_name': output_name,
+            'difficulty': difficulty,
+            'count': count,
+            'seed': seed,
+            'bounds': bounds,
+        })
+    return jobs
+
+def readBatchResults(results_name):
+    # outputs of the jobs that a previous run of the batch finished,
+    # as long as their booklet is still there. A run that crashed may
+    # have left half a line at the end, which we skip.
+    done = set()
+    if not os.path.exists(results_name):
+        return done
+    with open(results_name) as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue
+            if result.get('status') == 'ok':
+                done.add(result['output'])
+    return done
+
+def runBatch(jobs_name, results_name=None, concurrency=1, workers=1, tracer=None):
+    # Makes every booklet of a batch manifest (see readBatchJobs) in this
+    # one process, so that imports, images and caches (eg: the drawing
+    # cache, and the tables behind Question.solveHints) are loaded once
+    # for all of them, with up to 'concurrency' jobs at a time on threads.
+    # (Question generation is mostly Python, so for more CPU use workers:
+    # processes per job, see generateQuestions.)
+    # One line per job goes to the results file (jobs.results.jsonl by
+    # default) as soon as it finishes, with its status and timings.
+    # Running the batch again skips the jobs recorded as 'ok', so a
+    # crashed batch picks up where it left off.
+    # Returns the results of the jobs that were run.
+    if results_name is None:
+        results_name = os.path.splitext(jobs_name)[0] + '.results.jsonl'
+    if tracer is None:
+        tracer = Tracer(enabled=False)
+    jobs = readBatchJobs(jobs_name)
+    done = readBatchResults(results_name)
+    if os.path.exists(results_name):
+        # end the half line a crash may have left, or the
+        # first result we append would be lost in it
+        with open(results_name, 'rb+') as f:
+            if f.seek(0, os.SEEK_END) > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    f.write(b'\n')
+    todo = [job for job in jobs if not (job['output'] in done and os.path.exists(job['output_name']))]
+    info('Batch: ' + str(len(jobs)) + ' jobs, ' + str(len(jobs) - len(todo)) + ' already done')
+    drawing_cache = DrawingCache()
+    lock = threading.Lock()
+    results = list()
+
+    def runJob(job):
+        seed = job['seed']
+        if seed is None:
+            seed = newSeed()
+        result = {'output': job['output'], 'line': job['line'], 'difficulty': job['difficulty'].name, 'seed': seed}
+        start = time.perf_counter()
+        try:
+            with tracer.span('batch job', 'batch', output=job['output']):
+                booklet = BB(job['difficulty'], job['output_name'], tracer, seed=seed, workers=workers, build=False,
+                             drawing_cache=drawing_cache, bounds=job['bounds'], num_questions=job['count'])
+                built = time.perf_counter()
+                booklet.build()
+            result['status'] = 'ok'
+            result['generate_seconds'] = built - start
+            result['render_seconds'] = time.perf_counter() - built
+            result['count'] = booklet.num_questions
+            result['pages'] = booklet.answer_key_pages[1]
+        except Exception as e:
+            # one bad job should not take the rest of the batch down
+            result['status'] = 'error'
+            result['error'] = type(e).__name__ + ': ' + str(e)
+        result['seconds'] = time.perf_counter() - start
+        with lock:
+            results.append(result)
+            with open(results_name, 'a') as f:
+                f.write(json.dumps(result) + '\n')
+            info('Batch: [' + str(len(results)) + '/' + str(len(todo)) + '] ' + job['output'] + ': ' + result['status'] + ' (' + '%.2fs' % result['seconds'] + ')')
+        return result
+
+    with ThreadPoolExecutor(max(1, concurrency)) as pool:
+        list(pool.map(runJob, todo))
+    failed = [result for result in results if result['status'] != 'ok']
+    if len(failed):
+        warn('Batch: ' + str(len(failed)) + ' jobs failed, see: ' + results_name)
+    info('Batch: drawing cache hits: ' + str(drawing_cache.hits) + ', misses: ' + str(drawing_cache.misses))
+    return results
+
+# Responses are graded as bit masks: bit n is set when choice n is
+# circled, bit 0 when something that is not a choice number is.
+MAX_CHOICE_BITS=15
+
+def readAnswerKeys(key_names):
+    # answer keys (see BB.answerKey) by booklet id
+    keys = dict()
+    for key_name in key_names:
+        with open(key_name) as f:
+            key = json.load(f)
+        if key['id'] in keys:
+            raise BBError('Two answer keys for booklet ' + key['id'] + ': ' + keys[key['id']]['file'] + ' and ' + key_name)
+        key['file'] = key_name
+        keys[key['id']] = key
+    if len(keys) == 0:
+        raise BBError('No answer keys to grade with')
+    return keys
+
+def choiceMask(circled):
+    # circled: None or '' (blank), a choice number, a list of them,
+    # or a string of them (eg: '2 5', '2;5')
+    if circled is None:
+        return 0
+    if isinstance(circled, str):
+        circled = circled.replace(';', ' ').replace('|', ' ').replace('+', ' ').replace(',', ' ').split()
+    elif not isinstance(circled, list):
+        circled = [circled]
+    mask = 0
+    for n in circled:
+        try:
+            n = int(n)
+        except (TypeError, ValueError):
+            n = 0
+        if n < 1 or n > MAX_CHOICE_BITS:
+            n = 0
+        mask |= 1 << n
+    return mask
+
+def readResponses(responses_name):
+    # Student responses, from a CSV file with a header row:
+    #   student,booklet,1,2,3,...
+    #   ann,3f9a0c21d4e7,2 5,3,,1
+    # (booklet is the booklet id printed on its answer key, optional
+    # when grading with a single key; cells hold the circled choice
+    # numbers, a blank cell is an unanswered puzzle)
+    # or a JSONL file with one student per line:
+    #   {"student": "ann", "booklet": "3f9a0c21d4e7", "answers": [[2, 5], 3, null, 1]}
+    # Returns (students, booklets, masks): masks holds one row of
+    # choiceMask()s per student.
+    students = list()
+    booklets = list()
+    masks = list()
+    with open(responses_name, newline='') as f:
+        if responses_name.lower().endswith('.csv'):
+            reader = csv.reader(f)
+            header = [name.strip().lower() for name in next(reader, [])]
+            if len(header) == 0 or header[0] != 'student':
+                raise BBError(responses_name + ': the first column must be "student"')
+            first_answer = 2 if len(header) > 1 and header[1] == 'booklet' else 1
+            for row in reader:
+                if len(row) == 0:
+                    continue
+                students.append(row[0])
+                booklet = row[1].strip() if first_answer == 2 else ''
+                booklets.append(booklet or None)
+                masks.append([choiceMask(cell) for cell in row[first_answer:]])
+        else:
+            for line_number, line in enumerate(f, 1):
+                if line.strip() == '':
+                    continue
+                try:
+                    response = json.loads(line)
+                except ValueError as e:
+                    raise BBError(responses_name + ':' + str(line_number) + ': not valid JSON (' + str(e) + ')')
+                students.append(response.get('student', str(line_number)))
+                booklet = response.get('booklet')
+                booklets.append(None if booklet is None else str(booklet))
+                masks.append([choiceMask(circled) for circled in response.get('answers', [])])
+    return students, booklets, masks
+
+class GradeReport:
+    # What gradeResponses() found: one row per student and one per
+    # puzzle of every booklet, written out as CSV by write().
+    student_fields = ['student', 'booklet', 'score', 'puzzles', 'percent', 'blank', 'invalid']
+    puzzle_fields = ['booklet', 'puzzle', 'answers', 'responses', 'correct', 'percent', 'blank', 'invalid', 'choice_counts', 'top_distractor']
+
+    def __init__(self):
+        self.students = list()
+        self.puzzles = list()
+
+    def summary(self):
+        lines = list()
+        if len(self.students):
+            percents = [student['percent'] for student in self.students]
+            lines.append('Graded %d students: mean %.1f%%, min %.1f%%, max %.1f%%' % (len(percents), sum(percents)/len(percents), min(percents), max(percents)))
+        # the puzzles the fewest students got right
+        hardest = sorted((puzzle for puzzle in self.puzzles if puzzle['responses']), key=lambda puzzle: puzzle['percent'])[:3]
+        for puzzle in hardest:
+            lines.append('Hard puzzle: booklet %s Q%d: %.1f%% correct, top distractor: %s' % (puzzle['booklet'], puzzle['puzzle'], puzzle['percent'], puzzle['top_distractor']))
+        return lines
+
+    def printSummary(self):
+        for line in self.summary():
+            info(line)
+
+    def write(self, students_name, puzzles_name):
+        for (name, fields, rows) in ((students_name, GradeReport.student_fields, self.students), (puzzles_name, GradeReport.puzzle_fields, self.puzzles)):
+            with open(name, 'w', newline='') as f:
+                writer = csv.DictWriter(f, fields)
+                writer.writeheader()
+                for row in rows:
+                    row = dict(row)
+                    for field in ('answers', 'choice_counts'):
+                        if field in row:
+                            row[field] = ' '.join(str(n) for n in row[field])
+                    writer.writerow(row)
+
+def gradeResponses(keys, students, booklets, masks):
+    # Grades every student's responses (see readResponses) against the
+    # answer key of their booklet (keys: see readAnswerKeys) in a few
+    # passes over arrays of students x puzzles, rather than puzzle by
+    # puzzle. A puzzle is right when exactly its correct choices are
+    # circled. Returns a GradeReport.
+    ids = sorted(keys)
+    num_puzzles = max(len(keys[key_id]['puzzles']) for key_id in ids)
+    # per booklet and puzzle: the correct choices, and the choices there
+    # are (as masks). Puzzles a booklet does not have allow nothing.
+    key_masks = np.zeros((len(ids), num_puzzles), dtype=np.uint16)
+    allowed = np.zeros((len(ids), num_puzzles), dtype=np.uint16)
+    for k, key_id in enumerate(ids):
+        for p, puzzle in enumerate(keys[key_id]['puzzles']):
+            key_masks[k, p] = choiceMask(puzzle['answers'])
+            allowed[k, p] = ((1 << (puzzle['choices']+1)) - 1) & ~1
+
+    key_idx = {key_id: k for k, key_id in enumerate(ids)}
+    booklet_idx = np.zeros(len(students), dtype=np.intp)
+    for i, booklet in enumerate(booklets):
+        if booklet is None and len(ids) == 1:
+            booklet = ids[0]
+        if booklet not in keys:
+            raise BBError('No answer key for booklet ' + str(booklet) + ' of student: ' + str(students[i]))
+        booklet_idx[i] = key_idx[booklet]
+        if len(masks[i]) > len(keys[booklet]['puzzles']):
+            raise BBError('Student ' + str(students[i]) + ' answered ' + str(len(masks[i])) + ' puzzles, booklet ' + str(booklet) + ' has ' + str(len(keys[booklet]['puzzles'])))
+    responses = np.zeros((len(students), num_puzzles), dtype=np.uint16)
+    for i, row in enumerate(masks):
+        responses[i, :len(row)] = row
+
+    expected = key_masks[booklet_idx]
+    valid = allowed[booklet_idx] != 0
+    correct = (responses == expected) & valid
+    blank = (responses == 0) & valid
+    invalid = ((responses & ~allowed[booklet_idx]) != 0) & valid
+    # circled[i, p, n-1]: student i circled choice n of puzzle p
+    circled = (responses[:, :, np.newaxis] >> np.arange(1, MAX_CHOICE_BITS+1, dtype=np.uint16)) & 1
+
+    report = GradeReport()
+    score = correct.sum(axis=1)
+    total = valid.sum(axis=1)
+    percent = np.round(100.0 * score / np.maximum(1, total), 1).tolist()
+    score = score.tolist()
+    total = total.tolist()
+    student_ids = [ids[k] for k in booklet_idx.tolist()]
+    num_blank = blank.sum(axis=1).tolist()
+    num_invalid = invalid.sum(axis=1).tolist()
+    for i in range(len(students)):
+        report.students.append({
+            'student': students[i],
+            'booklet': student_ids[i],
+            'score': score[i],
+            'puzzles': total[i],
+            'percent': percent[i],
+            'blank': num_blank[i],
+            'invalid': num_invalid[i],
+        })
+
+    for k, key_id in enumerate(ids):
+        rows = booklet_idx == k
+        num_responses = int(rows.sum())
+        num_correct = correct[rows].sum(axis=0)
+        num_blank = blank[rows].sum(axis=0)
+        num_invalid = invalid[rows].sum(axis=0)
+        counts = circled[rows].sum(axis=0)
+        for p, puzzle in enumerate(keys[key_id]['puzzles']):
+            choice_counts = counts[p, :puzzle['choices']].tolist()
+            # the incorrect choice circled most often, if any was
+            wrong = [(n, choice_counts[n-1]) for n in range(1, puzzle['choices']+1) if n not in puzzle['answers'] and choice_counts[n-1] > 0]
+            top_distractor = max(wrong, key=lambda item: item[1])[0] if len(wrong) else ''
+            report.puzzles.append({
+                'booklet': key_id,
+                'puzzle': p+1,
+                'answers': puzzle['answers'],
+                'responses': num_responses,
+                'correct': int(num_correct[p]),
+                'percent': round(100.0 * int(num_correct[p]) / max(1, num_responses), 1),
+                'blank': int(num_blank[p]),
+                'invalid': int(num_invalid[p]),
+                'choice_counts': choice_counts,
+                'top_distractor': top_distractor,
+            })
+    return report
+
+def gradeFiles(responses_name, key_names):
+    # Grades a file of responses (see readResponses) and writes the
+    # report next to it: responses.students.csv and responses.puzzles.csv
+    keys = readAnswerKeys(key_names)
+    [students, booklets, masks] = readResponses(responses_name)
+    report = gradeResponses(keys, students, booklets, masks)
+    base = os.path.splitext(responses_name)[0]
+    report.write(base + '.students.csv', base + '.puzzles.csv')
+    report.printSummary()
+    info('Grades written to: ' + base + '.students.csv and ' + base + '.puzzles.csv')
+    return report
+
+def main(difficulty_level, output_name, trace_name=None, seed=None, workers=1, edit_puzzle=None, bound_overrides=None, estimate_only=False, batch_name=None, results_name=None, concurrency=1, key_name=None, grade_name=None, key_names=None):
+    global log_stream
+    if output_name == '-':
+        # the PDF goes to stdout, our messages to stderr
+        output_name = sys.stdout.buffer
+        log_stream = sys.stderr
+    tracer = Tracer(enabled=trace_name is not None)
+    bounds = None
+    if bound_overrides or estimate_only:
+        if difficulty_level is None:
+            raise BBError('-bounds and -estimate need a -level (1, 2, 3 or 4)')
+        # find out what user-defined bounds cost before committing to them
+        bounds = Bounds(difficulty_level, **(bound_overrides or {}))
+        estimate = estimateCost(bounds)
+        estimate.printSummary()
+        if estimate_only:
+            return
+        if not estimate.feasible():
+            raise BBError('Refusing bounds: ' + estimate.reason)
+    if grade_name is not None:
+        gradeFiles(grade_name, key_names or [])
+    elif batch_name is not None:
+        runBatch(batch_name, results_name, concurrency, workers, tracer)
+    elif edit_puzzle is not None:
+        editBooklet(output_name, edit_puzzle, tracer)
+    else:
+        BB(difficulty_level, output_name, tracer, seed=seed, workers=workers, bounds=bounds, key_name=key_name)
+    if trace_name is not None:
+        tracer.writeChromeTrace(trace_name)
+        info('Trace written to: ' + trace_name)
+        tracer.printSummary()
 
 def usage(mandatory_arg_names):
     info ('Program takes ' + str(len(mandatory_arg_names)) + ' arguments')
@@ -927,6 +2798,18 @@ def processArgs(args, mandatory_arg_names):
     idx=1
     difficulty=None
     output_name=None
+    trace_name=None
+    seed=None
+    workers=1
+    edit_puzzle=None
+    bound_overrides=dict()
+    estimate_only=False
+    batch_name=None
+    results_name=None
+    concurrency=1
+    key_name=None
+    grade_name=None
+    key_names=list()
     while idx < len(args):
         arg = args[idx]
         if arg.lower() == '-level':
@@ -936,13 +2819,19 @@ def processArgs(args, mandatory_arg_names):
                 difficulty=Difficulty.MEDIUM
             elif args[idx+1]=='3':
                 difficulty=Difficulty.HARD
+            elif args[idx+1]=='4':
+                difficulty=Difficulty.EXPERT
             else:
-                warn('Difficulty level: ' + args[idx+1] + ' is not valid. Use 1, 2 or 3.')
+                warn('Difficulty level: ' + args[idx+1] + ' is not valid. Use 1, 2, 3 or 4.')
                 difficulty=Difficulty.MEDIUM
             idx+=2
         elif arg.lower() == '-output':
             # verify that path exists, and is writeable
+            # ('-' writes the PDF to stdout)
             output_name = args[idx+1]
+            if output_name == '-':
+                idx+=2
+                continue
             dir_name = os.path.dirname(output_name)
             if dir_name == '':
                 dir_name = '.'
@@ -955,19 +2844,100 @@ def processArgs(args, mandatory_arg_names):
                 error('File path not writeable: ' + dir_name)
                 sys.exit()
             idx+=2
+        elif arg.lower() == '-trace':
+            # optional: where to write a Chrome trace of this run
+            trace_name = args[idx+1]
+            idx+=2
+        elif arg.lower() == '-seed':
+            # optional: recreate the booklet printed with this seed
+            if args[idx+1].isdigit():
+                seed = int(args[idx+1])
+            else:
+                warn('Seed: ' + args[idx+1] + ' is not valid. Use a non-negative integer.')
+            idx+=2
+        elif arg.lower() == '-edit':
+            # optional: replace just this puzzle of an existing booklet
+            if args[idx+1].isdigit():
+                edit_puzzle = int(args[idx+1])
+            else:
+                warn('Puzzle number: ' + args[idx+1] + ' is not valid.')
+            idx+=2
+        elif arg.lower() == '-workers':
+            # optional: number of processes generating questions
+            if args[idx+1].isdigit() and int(args[idx+1]) > 0:
+                workers = int(args[idx+1])
+            else:
+                warn('Workers: ' + args[idx+1] + ' is not valid. Using 1.')
+            idx+=2
+        elif arg.lower() == '-bounds':
+            # optional: change the level's bounds,
+            # eg: -bounds max_variables=5,max_variable_value=6,max_coefficient=4
+            for item in args[idx+1].split(','):
+                [name, _, value] = item.partition('=')
+                if value.lower() in ('true', 'false'):
+                    bound_overrides[name] = value.lower() == 'true'
+                elif value.isdigit():
+                    bound_overrides[name] = int(value)
+                else:
+                    warn('Bound: ' + item + ' is not valid. Use name=value.')
+            idx+=2
+        elif arg.lower() == '-estimate':
+            # optional: only estimate what making the booklet costs
+            estimate_only=True
+            idx+=1
+        elif arg.lower() == '-batch':
+            # instead of -level and -output: make every booklet
+            # of a manifest of jobs (see readBatchJobs)
+            batch_name = args[idx+1]
+            if not os.path.exists(batch_name):
+                error('Batch manifest not found: ' + batch_name)
+                sys.exit()
+            idx+=2
+        elif arg.lower() == '-results':
+            # optional: where -batch writes its results (and resumes from)
+            results_name = args[idx+1]
+            idx+=2
+        elif arg.lower() == '-concurrency':
+            # optional: how many -batch jobs run at a time
+            if args[idx+1].isdigit() and int(args[idx+1]) > 0:
+                concurrency = int(args[idx+1])
+            else:
+                warn('Concurrency: ' + args[idx+1] + ' is not valid. Using 1.')
+            idx+=2
+        elif arg.lower() == '-key':
+            # optional: where to write the answer key as JSON
+            # (by default next to the PDF: booklet.key.json)
+            key_name = args[idx+1]
+            idx+=2
+        elif arg.lower() == '-grade':
+            # instead of -level and -output: grade a CSV or JSONL
+            # file of student responses (see readResponses)
+            grade_name = args[idx+1]
+            if not os.path.exists(grade_name):
+                error('Responses not found: ' + grade_name)
+                sys.exit()
+            idx+=2
+        elif arg.lower() == '-keys':
+            # with -grade: the answer keys, comma separated
+            key_names += args[idx+1].split(',')
+            idx+=2
         else:
             warn('Unknown argument: ' + args[idx] + ' ignored')
             idx+=1
-    return [difficulty, output_name]
+    return [difficulty, output_name, trace_name, seed, workers, edit_puzzle, bound_overrides, estimate_only, batch_name, results_name, concurrency, key_name, grade_name, key_names]
 
 if __name__ == '__main__':
     debug_flag=True
     args = sys.argv
-    mandatory_arg_names = list([('-level', 'Difficulty level (1, 2 or 3)'),('-output', 'Valid Writeable File Path Name of Ooutput PDF File')])
+    mandatory_arg_names = list([('-level', 'Difficulty level (1, 2, 3 or 4)'),('-output', 'Valid Writeable File Path Name of Ooutput PDF File (or - for stdout)')])
     NUM_MANDATORY_ARGS = 2*len(mandatory_arg_names)
-    if len(args) <= NUM_MANDATORY_ARGS:
+    if len(args) <= NUM_MANDATORY_ARGS and '-batch' not in [arg.lower() for arg in args] and '-grade' not in [arg.lower() for arg in args]:
         error ('Insufficient Arguments')
         usage(mandatory_arg_names)
         sys.exit()
-    [difficulty, output_name] = processArgs(args, mandatory_arg_names)
-    main(difficulty, output_name)
+    [difficulty, output_name, trace_name, seed, workers, edit_puzzle, bound_overrides, estimate_only, batch_name, results_name, concurrency, key_name, grade_name, key_names] = processArgs(args, mandatory_arg_names)
+    try:
+        main(difficulty, output_name, trace_name, seed, workers, edit_puzzle, bound_overrides, estimate_only, batch_name, results_name, concurrency, key_name, grade_name, key_names)
+    except BBError as e:
+        error(str(e))
+        sys.exit()
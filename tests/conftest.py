@@ -0,0 +1,5 @@
+import os
+import sys
+
+# bb.py is a single script under src/, not an installed package
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
@@ -0,0 +1,80 @@
+import json
+import os
+
+import pytest
+
+import bb
+
+JOBS = [
+    {'difficulty': 1, 'count': 2, 'seed': 1, 'output': 'a.pdf'},
+    {'difficulty': 'hard', 'count': 2, 'seed': 2, 'output': 'b.pdf'},
+    {'difficulty': 'EASY', 'count': 3, 'seed': 3, 'output': 'out/c.pdf', 'bounds': {'max_variables': 4}},
+]
+
+
+def writeJobs(tmp_path, lines):
+    name = tmp_path / 'jobs.jsonl'
+    name.write_text(''.join(line + '\n' for line in lines))
+    return str(name)
+
+
+@pytest.fixture
+def jobs_name(tmp_path):
+    (tmp_path / 'out').mkdir()
+    return writeJobs(tmp_path, [json.dumps(job) for job in JOBS])
+
+
+def outputs(results):
+    return sorted(result['output'] for result in results)
+
+
+def test_batch_runs_every_job(tmp_path, jobs_name):
+    results = bb.runBatch(jobs_name, concurrency=2)
+    assert outputs(results) == ['a.pdf', 'b.pdf', 'out/c.pdf']
+    assert all(result['status'] == 'ok' for result in results)
+    assert {result['output']: result['count'] for result in results} == {'a.pdf': 2, 'b.pdf': 2, 'out/c.pdf': 3}
+    for job in JOBS:
+        assert (tmp_path / job['output']).exists()
+        assert (tmp_path / bb.manifestPath(job['output'])).exists()
+    # nothing left to do
+    assert bb.runBatch(jobs_name) == []
+
+
+def test_batch_redoes_a_deleted_booklet(tmp_path, jobs_name):
+    bb.runBatch(jobs_name)
+    os.remove(tmp_path / 'b.pdf')
+    results = bb.runBatch(jobs_name)
+    assert outputs(results) == ['b.pdf']
+    assert (tmp_path / 'b.pdf').exists()
+
+
+def test_batch_resumes_after_a_crash(tmp_path, jobs_name):
+    bb.runBatch(jobs_name)
+    results_name = tmp_path / 'jobs.results.jsonl'
+    lines = results_name.read_text().splitlines(keepends=True)
+    assert len(lines) == 3
+    # the batch crashed while writing the result of its last job
+    last = json.loads(lines[-1])['output']
+    results_name.write_text(''.join(lines[:-1]) + lines[-1][:len(lines[-1])//2])
+    results = bb.runBatch(jobs_name)
+    assert outputs(results) == [last]
+    assert bb.runBatch(jobs_name) == []
+
+
+def test_batch_refuses_bad_lines(tmp_path):
+    good = json.dumps(JOBS[0])
+    bad_lines = [
+        ('{"difficulty": 1', 'not valid JSON'),
+        ('{"difficulty": 5, "output": "x.pdf"}', 'difficulty must be'),
+        ('{"difficulty": 1}', 'a job needs an "output"'),
+        ('{"difficulty": 1, "count": 0, "output": "x.pdf"}', 'count must be a positive integer'),
+        ('{"difficulty": 1, "bounds": [5], "output": "x.pdf"}', 'bounds must be an object'),
+        ('{"difficulty": 1, "bounds": {"max_vars": 5}, "output": "x.pdf"}', 'Unknown bound'),
+        ('{"difficulty": 4, "bounds": {"min_variables": 4}, "output": "x.pdf"}', 'refusing bounds'),
+        (good, 'another job already writes to'),
+    ]
+    for bad, message in bad_lines:
+        jobs_name = writeJobs(tmp_path, [good, '', bad])
+        with pytest.raises(bb.BBError, match=':3: ' + message):
+            bb.runBatch(jobs_name)
+    assert not (tmp_path / 'a.pdf').exists()
@@ -0,0 +1,72 @@
+import pytest
+
+import bb
+
+
+def test_presets_are_feasible():
+    for difficulty in bb.Difficulty:
+        bounds = bb.Bounds(difficulty)
+        assert bounds.infeasibleReason() is None
+        assert not bounds.isCustom()
+
+
+@pytest.mark.parametrize('difficulty, overrides, reason', [
+    (bb.Difficulty.EASY, {'min_variables': 2}, 'min_variables must be at least 3'),
+    (bb.Difficulty.EASY, {'min_variables': 5, 'max_variables': 4}, 'max_variables must be at least min_variables'),
+    (bb.Difficulty.HARD, {'max_variables': 13}, 'max_variables can not be more than 12'),
+    (bb.Difficulty.EASY, {'max_variable_value': 1}, 'max_variable_value must be at least 2'),
+    (bb.Difficulty.EASY, {'max_coefficient': 0}, 'max_coefficient must be at least 1'),
+    (bb.Difficulty.EASY, {'max_coefficient': 11}, 'max_coefficient can not be more than 10'),
+    (bb.Difficulty.EASY, {'num_choices': 9}, 'num_choices must be between 3 and 8'),
+    (bb.Difficulty.EASY, {'max_variables': '5'}, 'max_variables must be an integer'),
+    (bb.Difficulty.EASY, {'max_variables': True}, 'max_variables must be an integer'),
+    (bb.Difficulty.EASY, {'use_inequality': 1}, 'use_inequality must be true or false'),
+    (bb.Difficulty.EXPERT, {'min_variables': 4}, 'min_variables must be at least 5 at level EXPERT'),
+    (bb.Difficulty.HARD, {'max_variables': 12, 'max_variable_value': 4}, 'max_variable_value^max_variables'),
+    (bb.Difficulty.MEDIUM, {'max_coefficient': 10}, 'max_coefficient is too big'),
+])
+def test_infeasible_reason(difficulty, overrides, reason):
+    bounds = bb.Bounds(difficulty, **overrides)
+    assert bounds.isCustom()
+    assert bounds.infeasibleReason().startswith(reason)
+    with pytest.raises(bb.BBError):
+        bb.checkBounds(bounds)
+
+
+def test_expert_with_five_variables_is_feasible():
+    bounds = bb.Bounds(bb.Difficulty.EXPERT, min_variables=5, max_variables=6)
+    assert bounds.infeasibleReason() is None
+
+
+def test_unknown_bound_and_missing_difficulty():
+    with pytest.raises(bb.BBError, match='Unknown bound'):
+        bb.Bounds(bb.Difficulty.EASY, max_vars=5)
+    with pytest.raises(bb.BBError, match='difficulty level'):
+        bb.Bounds(None, max_variables=5)
+    with pytest.raises(bb.BBError, match='need a -level'):
+        bb.main(None, 'unused.pdf', bound_overrides={'max_variables': 5})
+
+
+def test_estimate_refuses_infeasible_bounds_without_trying():
+    # coefficientGrid(0, ...) used to crash in here
+    bounds = bb.Bounds(bb.Difficulty.EXPERT, min_variables=4, max_variables=4)
+    estimate = bb.estimateCost(bounds)
+    assert not estimate.feasible()
+    assert estimate.reason == 'min_variables must be at least 5 at level EXPERT'
+    assert estimate.attempts == 0
+
+
+def test_estimate_refuses_slow_bounds():
+    bounds = bb.Bounds(bb.Difficulty.EASY, max_variables=4)
+    estimate = bb.estimateCost(bounds, count=10, samples=2, max_seconds=0.0)
+    assert estimate.questions > 0
+    assert not estimate.feasible()
+    assert estimate.reason.startswith('a booklet would take about')
+
+
+def test_estimate_accepts_custom_bounds():
+    bounds = bb.Bounds(bb.Difficulty.MEDIUM, max_variables=4, max_variable_value=5)
+    estimate = bb.estimateCost(bounds, count=10, samples=3)
+    assert estimate.feasible()
+    assert estimate.questions == 3
+    assert estimate.attemptsPerQuestion() >= 1
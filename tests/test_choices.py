@@ -0,0 +1,98 @@
+import io
+import itertools
+
+import numpy as np
+
+import bb
+
+
+def handBuiltQuestion():
+    # three shapes with the single hint x = y: z can be anything,
+    # so the hint decides some choices but not others.
+    bounds = bb.Bounds(bb.Difficulty.HARD)
+    record = {
+        'vars': [2, 2, 1],
+        'hints': [([1, 0, 0], '=', [0, 1, 0], False)],
+        'choices': [],
+    }
+    q = bb.Question(bounds, record=record)
+    q.solutions = q.solveHints()
+    return q
+
+
+def test_classify_implied_contradicted_undetermined():
+    q = handBuiltQuestion()
+    implied = bb.Hint(q.vars, [2, 0, 0], '=', [1, 1, 0])        # 2x = x + y
+    contradicted = bb.Hint(q.vars, [2, 0, 0], '=', [0, 1, 0])   # 2x = y
+    undetermined = bb.Hint(q.vars, [1, 0, 0], '=', [0, 0, 1])   # x = z
+    inequality = bb.Hint(q.vars, [1, 0, 0], '<', [0, 1, 1])     # x < y + z
+    assert q.classifyChoices([implied, contradicted, undetermined, inequality]) == [
+        bb.Implication.IMPLIED,
+        bb.Implication.CONTRADICTED,
+        bb.Implication.UNDETERMINED,
+        bb.Implication.IMPLIED,
+    ]
+
+
+def test_solutions_are_the_assignments_that_satisfy_the_hints():
+    q = handBuiltQuestion()
+    points = bb.assignmentSpace(3, q.bounds.getMaxVariableValue())[q.solutions]
+    expected = [p for p in itertools.product(range(1, 4), repeat=3) if p[0] == p[1]]
+    assert sorted(tuple(int(v) for v in p) for p in points) == expected
+
+
+def holds(choice, values):
+    lhs = sum(c*v for c, v in zip(choice.lhs, values))
+    rhs = sum(c*v for c, v in zip(choice.rhs, values))
+    return {'=': lhs == rhs, '<': lhs < rhs, '>': lhs > rhs}[choice.op]
+
+
+def test_correct_choices_follow_from_the_hints():
+    # checked by brute force over every assignment the bounds allow
+    for difficulty in (bb.Difficulty.EASY, bb.Difficulty.MEDIUM, bb.Difficulty.HARD):
+        max_value = bb.Bounds(difficulty).getMaxVariableValue()
+        for q in itertools.islice(bb.iterQuestions(difficulty, seed=11), 5):
+            solutions = [p for p in itertools.product(range(1, max_value+1), repeat=q.num_vars)
+                         if all(holds(hint, p) for hint in q.hints)]
+            correct = [choice for choice in q.choices if choice.correct_choice]
+            assert len(correct) > 0
+            for choice in correct:
+                assert all(holds(choice, p) for p in solutions)
+            for choice in q.choices:
+                assert not q.isIdentical(q.hints, choice)
+
+
+def satisfied(relations, points):
+    # for each relation (row) and point (column), whether it holds
+    diff = np.array([[l - r for l, r in zip(h.lhs, h.rhs)] for h in relations])
+    values = diff @ points.T
+    ops = np.array([h.op for h in relations])[:, np.newaxis]
+    return np.where(ops == '=', values == 0, np.where(ops == '<', values < 0, values > 0))
+
+
+def test_expert_questions():
+    max_value = bb.Bounds(bb.Difficulty.EXPERT).getMaxVariableValue()
+    for q in itertools.islice(bb.iterQuestions(bb.Difficulty.EXPERT, seed=11), 3):
+        assert 10 <= q.num_vars <= 12
+        assert len(q.hints) == q.num_vars - 1
+        # every variable shows up in some hint
+        for j in range(q.num_vars):
+            assert any(hint.lhs[j] or hint.rhs[j] for hint in q.hints)
+        # checked by brute force over every assignment the bounds allow
+        points = np.array(list(itertools.product(range(1, max_value+1), repeat=q.num_vars)))
+        solutions = points[satisfied(q.hints, points).all(axis=0)]
+        holds_everywhere = satisfied(q.choices, solutions).all(axis=1)
+        assert any(choice.correct_choice for choice in q.choices)
+        for choice, implied in zip(q.choices, holds_everywhere):
+            assert choice.correct_choice == implied
+            assert not q.isIdentical(q.hints, choice)
+
+
+def test_expert_shapes_are_marked_past_six_variables():
+    booklet = bb.BB(bb.Difficulty.EXPERT, io.BytesIO(), seed=2, num_questions=2)
+    q = booklet.questions[-1]
+    assert len(booklet.shape_names) == q.num_vars
+    assert len(set(booklet.shape_names)) == q.num_vars
+    marked = [shape for shape in booklet.shapes if isinstance(shape, bb.MarkedShape)]
+    assert len(marked) == q.num_vars - booklet.max_shapes
+    assert all(shape.mark == 1 for shape in marked)
@@ -0,0 +1,79 @@
+import json
+
+import pytest
+
+import bb
+
+pypdf = pytest.importorskip('pypdf')
+
+PUZZLE = 2
+
+
+def readBooklet(name):
+    with open(bb.manifestPath(name)) as f:
+        manifest = json.load(f)
+    with open(bb.answerKeyPath(name)) as f:
+        key = json.load(f)
+    reader = pypdf.PdfReader(name)
+    return manifest, key, reader
+
+
+def puzzlePages(manifest, reader, i):
+    # text and drawing of the pages of puzzle i (counting from 0)
+    [first, last] = manifest['questions'][i]['pages']
+    return [(page.extract_text(), page.get_contents().get_data()) for page in reader.pages[first-1:last]]
+
+
+def checkEdit(name):
+    before, old_key, old_reader = readBooklet(name)
+    bb.editBooklet(name, PUZZLE)
+    after, new_key, reader = readBooklet(name)
+
+    k = PUZZLE-1
+    assert after['questions'][k]['index'] == before['questions'][k]['index']
+    assert after['questions'][k]['attempt'] > before['questions'][k]['attempt']
+    for i in range(len(before['questions'])):
+        if i != k:
+            assert after['questions'][i]['attempt'] == before['questions'][i]['attempt']
+            assert puzzlePages(after, reader, i) == puzzlePages(before, old_reader, i)
+
+    # the page ranges in the manifest are those of the new PDF
+    next_page = 1
+    for i, entry in enumerate(after['questions']):
+        [first, last] = entry['pages']
+        assert first == next_page and last >= first
+        assert 'Puzzle ' + str(i+1) + '\n' in reader.pages[first-1].extract_text()
+        next_page = last+1
+    [first, last] = after['answer_key_pages']
+    assert first == next_page and last == len(reader.pages)
+    # (the first of them is blank)
+    key_text = ''.join(page.extract_text() for page in reader.pages[first-1:last])
+    assert key_text.startswith('Answer key:')
+
+    # a new puzzle is a new booklet, with a new answer key
+    assert new_key['seed'] == old_key['seed']
+    assert new_key['id'] != old_key['id']
+    assert new_key['id'] in key_text
+    assert [p['answers'] for p in new_key['puzzles']] == [entry['answers'] for entry in after['questions']]
+
+
+def test_edit_copies_the_other_pages(tmp_path):
+    name = str(tmp_path / 'booklet.pdf')
+    bb.BB(bb.Difficulty.EASY, name, seed=4)
+    checkEdit(name)
+
+
+def test_edit_without_pypdf_builds_again(tmp_path, monkeypatch):
+    name = str(tmp_path / 'booklet.pdf')
+    bb.BB(bb.Difficulty.EASY, name, seed=4)
+    monkeypatch.setattr(bb, 'pypdf', None)
+    checkEdit(name)
+
+
+def test_edit_refuses_bad_puzzle_numbers(tmp_path):
+    name = str(tmp_path / 'booklet.pdf')
+    with pytest.raises(bb.BBError, match='No booklet to edit'):
+        bb.editBooklet(name, 1)
+    bb.BB(bb.Difficulty.EASY, name, seed=4)
+    with pytest.raises(bb.BBError, match='Puzzle number must be between 1 and'):
+        bb.editBooklet(name, 0)
@@ -0,0 +1,109 @@
+import json
+
+import pytest
+
+import bb
+
+KEYS = [
+    {'id': 'k1', 'seed': 1, 'difficulty': 'EASY', 'puzzles': [
+        {'choices': 4, 'answers': [2]},
+        {'choices': 6, 'answers': [1, 5]},
+        {'choices': 4, 'answers': [3]},
+    ]},
+    {'id': 'k2', 'seed': 1, 'difficulty': 'HARD', 'puzzles': [
+        {'choices': 4, 'answers': [1]},
+        {'choices': 4, 'answers': [2, 3]},
+    ]},
+]
+
+CSV = '''student,booklet,1,2,3
+ann,k1,2,1 5,3
+bob,k1,4,5,
+cat,k1,7,5;1,x
+dan,k2,1,2
+'''
+
+JSONL = [
+    {'student': 'ann', 'booklet': 'k1', 'answers': [2, [1, 5], 3]},
+    {'student': 'bob', 'booklet': 'k1', 'answers': [4, [5], None]},
+    {'student': 'cat', 'booklet': 'k1', 'answers': [7, '5;1', 'x']},
+    {'student': 'dan', 'booklet': 'k2', 'answers': [1, 2]},
+]
+
+
+def writeKeys(tmp_path, keys):
+    names = list()
+    for key in keys:
+        name = str(tmp_path / (key['id'] + '.key.json'))
+        with open(name, 'w') as f:
+            json.dump(key, f)
+        names.append(name)
+    return names
+
+
+@pytest.fixture(params=['csv', 'jsonl'])
+def responses(tmp_path, request):
+    name = tmp_path / ('responses.' + request.param)
+    if request.param == 'csv':
+        name.write_text(CSV)
+    else:
+        name.write_text(''.join(json.dumps(row) + '\n' for row in JSONL))
+    return str(name)
+
+
+def test_grade_multi_circle_blank_and_invalid(tmp_path, responses):
+    keys = bb.readAnswerKeys(writeKeys(tmp_path, KEYS))
+    report = bb.gradeResponses(keys, *bb.readResponses(responses))
+
+    students = {row['student']: row for row in report.students}
+    assert [(students[s]['score'], students[s]['puzzles']) for s in ('ann', 'bob', 'cat', 'dan')] == [(3, 3), (0, 3), (1, 3), (1, 2)]
+    assert students['bob']['blank'] == 1
+    assert students['cat']['invalid'] == 2
+    assert students['dan']['booklet'] == 'k2'
+
+    puzzles = {(row['booklet'], row['puzzle']): row for row in report.puzzles}
+    assert puzzles[('k1', 1)]['correct'] == 1
+    assert puzzles[('k1', 1)]['invalid'] == 1
+    assert puzzles[('k1', 1)]['choice_counts'] == [0, 1, 0, 1]
+    assert puzzles[('k1', 1)]['top_distractor'] == 4
+    assert puzzles[('k1', 2)]['correct'] == 2
+    assert puzzles[('k1', 2)]['choice_counts'] == [2, 0, 0, 0, 3, 0]
+    assert puzzles[('k1', 3)]['blank'] == 1
+    assert puzzles[('k2', 2)]['responses'] == 1
+
+
+def test_report_files(tmp_path, responses):
+    bb.gradeFiles(responses, writeKeys(tmp_path, KEYS))
+    base = responses.rsplit('.', 1)[0]
+    students = open(base + '.students.csv').read().splitlines()
+    assert students[0] == 'student,booklet,score,puzzles,percent,blank,invalid'
+    assert students[1] == 'ann,k1,3,3,100.0,0,0'
+    puzzles = open(base + '.puzzles.csv').read().splitlines()
+    assert puzzles[2].startswith('k1,2,1 5,3,2,66.7,')
+
+
+def test_keys_with_the_same_id_are_refused(tmp_path):
+    names = writeKeys(tmp_path, KEYS[:1])
+    with pytest.raises(bb.BBError):
+        bb.readAnswerKeys(names + names)
+
+
+def test_booklets_with_the_same_seed_get_different_keys(tmp_path):
+    key_names = list()
+    for difficulty in (bb.Difficulty.EASY, bb.Difficulty.HARD):
+        output_name = str(tmp_path / (difficulty.name + '.pdf'))
+        bb.BB(difficulty, output_name, seed=7)
+        key_names.append(bb.answerKeyPath(output_name))
+    keys = bb.readAnswerKeys(key_names)
+    assert len(keys) == 2
+
+    # students who circled exactly the answers get everything right
+    students = list()
+    booklets = list()
+    masks = list()
+    for key_id, key in keys.items():
+        students.append(key['difficulty'])
+        booklets.append(key_id)
+        masks.append([bb.choiceMask(puzzle['answers']) for puzzle in key['puzzles']])
+    report = bb.gradeResponses(keys, students, booklets, masks)
+    assert [row['percent'] for row in report.students] == [100.0, 100.0]
@@ -0,0 +1,80 @@
+import threading
+import time
+
+import pytest
+
+import bb
+
+
+def waitForDepth(reservoir, depth, timeout=30.0):
+    deadline = time.perf_counter() + timeout
+    while reservoir.depth() < depth:
+        assert time.perf_counter() < deadline, 'reservoir did not refill'
+        time.sleep(0.01)
+
+
+class IdleReservoir(bb.QuestionReservoir):
+    # its thread runs, but never makes a question
+    def refillLoop(self):
+        with self.condition:
+            self.condition.wait_for(lambda: self.stopped)
+
+
+def test_take_has_no_repeats_and_refills():
+    reservoir = bb.QuestionReservoir(bb.Difficulty.EASY, high_water=8, seed=5).start()
+    try:
+        waitForDepth(reservoir, 8)
+        taken = reservoir.take(6) + reservoir.take(6, timeout=30) + reservoir.take(6, timeout=30)
+        fingerprints = [bb.questionFingerprint(q) for q in taken]
+        assert len(set(fingerprints)) == len(taken)
+        # questions come out in the order they were made
+        assert [q.index for q in taken] == sorted(q.index for q in taken)
+        waitForDepth(reservoir, 8)
+        time.sleep(0.05)
+        assert reservoir.depth() == 8
+        metrics = reservoir.metrics()
+        assert metrics['served'] == 18
+        assert metrics['generated'] == 26
+        assert metrics['depth'] == 8
+    finally:
+        reservoir.stop()
+
+
+def test_take_times_out_when_dry():
+    reservoir = IdleReservoir(bb.Difficulty.EASY, high_water=4, seed=5).start()
+    try:
+        with pytest.raises(bb.BBError, match='Timed out'):
+            reservoir.take(1, timeout=0.05)
+        with pytest.raises(bb.BBError, match='Can not take'):
+            reservoir.take(5)
+    finally:
+        reservoir.stop()
+    with pytest.raises(bb.BBError, match='not running'):
+        reservoir.take(1)
+
+
+def test_stop_wakes_up_take():
+    reservoir = IdleReservoir(bb.Difficulty.EASY, high_water=4, seed=5).start()
+    stopper = threading.Timer(0.05, reservoir.stop)
+    stopper.start()
+    start = time.perf_counter()
+    with pytest.raises(bb.BBError, match='was stopped'):
+        reservoir.take(1, timeout=30)
+    assert time.perf_counter() - start < 5
+    stopper.join()
+
+
+def test_refill_failure_comes_out_of_take(monkeypatch):
+    def broken(*args, **kwargs):
+        raise ValueError('no shapes left')
+    monkeypatch.setattr(bb, 'makeQuestion', broken)
+    reservoir = bb.QuestionReservoir(bb.Difficulty.EASY, high_water=4, seed=5).start()
+    try:
+        start = time.perf_counter()
+        with pytest.raises(bb.BBError, match='ValueError: no shapes left'):
+            reservoir.take(1, timeout=30)
+        assert time.perf_counter() - start < 5
+        with pytest.raises(bb.BBError, match='no shapes left'):
+            reservoir.metrics()
+    finally:
+        reservoir.stop()
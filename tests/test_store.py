@@ -0,0 +1,79 @@
+import multiprocessing
+from multiprocessing import shared_memory
+
+import pytest
+
+import bb
+
+SEED = 17
+
+
+def firstValid(difficulty, index):
+    # the question fillQuestionStore makes for an index
+    attempt = 0
+    while True:
+        q = bb.makeQuestion(difficulty, SEED, index, attempt)
+        if q.validate():
+            return q
+        attempt += 1
+
+
+def relations(relations):
+    return [(r.lhs, r.op, r.rhs, r.correct_choice) for r in relations]
+
+
+def test_workers_fill_one_store():
+    difficulty = bb.Difficulty.HARD
+    store = bb.SharedQuestionStore(difficulty, 64)
+    # overlapping ranges: indices 8..11 are made by two workers each
+    ranges = [range(0, 12), range(8, 20), range(20, 24)]
+    workers = [multiprocessing.Process(target=bb.fillQuestionStore, args=(store, SEED, indices)) for indices in ranges]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+        assert worker.exitcode == 0
+
+    expected = dict()
+    for index in range(24):
+        q = firstValid(difficulty, index)
+        expected.setdefault(bb.questionFingerprint(q), q)
+    # every question is stored, and none twice
+    assert store.count() == len(expected)
+
+    claimed = list()
+    while True:
+        q = store.claim()
+        if q is None:
+            break
+        claimed.append(q)
+    assert store.claimedCount() == store.count() == len(claimed)
+    assert store.claim() is None
+
+    fingerprints = [bb.questionFingerprint(q) for q in claimed]
+    assert sorted(fingerprints) == sorted(expected)
+    for q in claimed:
+        made = bb.makeQuestion(difficulty, q.seed, q.index, q.attempt)
+        assert q.seed == SEED
+        assert q.vars == made.vars
+        assert relations(q.hints) == relations(made.hints)
+        assert relations(q.choices) == relations(made.choices)
+
+    name = store.shm.name
+    store.close()
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=name)
+
+
+def test_store_refuses_repeats_and_overflow():
+    difficulty = bb.Difficulty.EASY
+    store = bb.SharedQuestionStore(difficulty, 2)
+    try:
+        first = firstValid(difficulty, 0)
+        assert store.append(first)
+        assert not store.append(bb.makeQuestion(difficulty, SEED, first.index, first.attempt))
+        assert store.append(firstValid(difficulty, 1))
+        assert not store.append(firstValid(difficulty, 2))
+        assert store.count() == 2
+    finally:
+        store.close()
@@ -0,0 +1,27 @@
+import io
+
+import bb
+
+
+def test_generate_questions_with_workers_matches_serial():
+    for difficulty in (bb.Difficulty.MEDIUM, bb.Difficulty.HARD):
+        serial = bb.generateQuestions(difficulty, 21, 6)
+        parallel = bb.generateQuestions(difficulty, 21, 6, workers=2)
+        assert [(q.index, q.attempt) for q in serial] == [(q.index, q.attempt) for q in parallel]
+        assert [bb.questionFingerprint(q) for q in serial] == [bb.questionFingerprint(q) for q in parallel]
+
+
+def test_booklet_with_workers_is_byte_identical():
+    serial = io.BytesIO()
+    bb.BB(bb.Difficulty.HARD, serial, seed=3)
+    parallel = io.BytesIO()
+    bb.BB(bb.Difficulty.HARD, parallel, seed=3, workers=2)
+    assert serial.getvalue() == parallel.getvalue()
+
+
+def test_seed_recreates_the_booklet():
+    first = io.BytesIO()
+    bb.BB(bb.Difficulty.EASY, first, seed=8)
+    second = io.BytesIO()
+    bb.BB(bb.Difficulty.EASY, second, seed=8)
+    assert first.getvalue() == second.getvalue()